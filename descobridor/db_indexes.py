@@ -0,0 +1,163 @@
+"""
+Indexes our hot queries need, and a check that the queries actually use them.
+
+usage:
+    # create the missing indexes, existing ones are left as they are
+    python descobridor/db_indexes.py create
+    # explain() every hot query, exits with 1 if any of them scans a whole collection
+    python descobridor/db_indexes.py check
+"""
+import argparse
+import os
+import sys
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from truby.db_connection import CosmosConnection, MongoConnection
+
+from descobridor.helpers import get_localization
+
+
+load_dotenv()
+
+CONNECTIONS = {"mongo": MongoConnection, "cosmos": CosmosConnection}
+
+
+class IndexSpec(NamedTuple):
+    database: str
+    collection: str
+    keys: List[Tuple[str, int]]
+    unique: bool = False
+
+    @property
+    def name(self) -> str:
+        # the name mongo gives it by default
+        return "_".join(f"{field}_{direction}" for (field, direction) in self.keys)
+
+
+class HotQuery(NamedTuple):
+    name: str
+    database: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+
+
+def required_indexes(language: str) -> List[IndexSpec]:
+    last_scraped = f"review_extr_ds_{language}"
+    return [
+        # GmapsClient candidates: sorted by priority, the filter is all $ne / $or
+        IndexSpec("mongo", "places", [("priority", -1), (last_scraped, 1)]),
+        # serp_sender.get_next_batch: data_id None, sorted by priority
+        IndexSpec("mongo", "places", [("data_id", 1), ("priority", -1)]),
+        IndexSpec("mongo", "places", [("place_id", 1)]),
+        # store_reviews looks duplicates up by this id. Not unique: two reviewers with the same
+        # name share an id, and a unique index would fail the whole bulk insert of a flush
+        IndexSpec("mongo", "reviews", [("unique_review_id", 1)]),
+        # known reviews of a place
+        IndexSpec("mongo", "reviews", [("place_id", 1), ("language", 1), ("scrape_ds", 1)]),
+        IndexSpec("mongo", "serp_cache", [("place_results.place_id", 1)]),
+        IndexSpec("cosmos", "raw_reviews", [("place_id", 1), ("page_number", 1)]),
+    ]
+
+
+def hot_queries(language: str) -> List[HotQuery]:
+    from descobridor.queueing.gmaps_scrape_sender import GmapsClient
+    last_scraped = GmapsClient.loc_last_scraped(language)
+    return [
+        HotQuery(
+            "gmaps candidates", "mongo", "places",
+            GmapsClient.scrape_conditions(last_scraped), [("priority", -1)]),
+        HotQuery(
+            "serp batch", "mongo", "places",
+            {"data_id": None, "unserpable": {"$ne": True}}, [("priority", -1)]),
+        HotQuery("place by id", "mongo", "places", {"place_id": "check"}),
+        HotQuery("review by id", "mongo", "reviews", {"unique_review_id": "check"}),
+        HotQuery(
+            "known reviews", "mongo", "reviews",
+            {"place_id": "check", "language": language, "scrape_ds": {"$lte": "2023-01-01"}}),
+        HotQuery("serp cache", "mongo", "serp_cache", {"place_results.place_id": "check"}),
+        HotQuery(
+            "next page token", "cosmos", "raw_reviews", {"page_number": 1, "place_id": "check"}),
+    ]
+
+
+def ensure_indexes(specs: List[IndexSpec]) -> List[str]:
+    """
+    create_index doesn't touch an index that already exists with the same keys and options
+    :returns: the problems
+    """
+    problems = []
+    for spec in specs:
+        try:
+            with CONNECTIONS[spec.database](spec.collection) as conn:
+                conn.collection.create_index(spec.keys, unique=spec.unique, name=spec.name)
+            print(f"[v] {spec.database}.{spec.collection} {spec.name}")
+        except Exception as e:
+            problems.append(f"{spec.database}.{spec.collection} {spec.name}: {e}")
+    return problems
+
+
+def plan_stages(plan: Any) -> Set[str]:
+    """
+    every stage of a winning plan, the stages are nested in inputStage / inputStages
+    """
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= plan_stages(item)
+    return stages
+
+
+def check_query(query: HotQuery) -> Tuple[List[str], List[str]]:
+    """
+    :returns: problems (a collection scan) and warnings (in-memory sort, unreadable plan)
+    """
+    with CONNECTIONS[query.database](query.collection) as conn:
+        cursor = conn.collection.find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(query.sort)
+        explained = cursor.limit(1).explain()
+    winning_plan = explained.get("queryPlanner", {}).get("winningPlan")
+    if winning_plan is None:
+        return [], [f"{query.name}: no winning plan in explain()"]
+    stages = plan_stages(winning_plan)
+    problems, warnings = [], []
+    if "COLLSCAN" in stages:
+        problems.append(f"{query.name}: collection scan on {query.database}.{query.collection}")
+    if "SORT" in stages:
+        warnings.append(f"{query.name}: sorted in memory")
+    return problems, warnings
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("command", choices=("create", "check"))
+    args.add_argument("--language", help="defaults to the language of the `country` env variable")
+    arguments = args.parse_args()
+    language = arguments.language or get_localization(os.environ["country"])["language"]
+
+    if arguments.command == "create":
+        problems = ensure_indexes(required_indexes(language))
+    else:
+        problems = []
+        for query in hot_queries(language):
+            query_problems, warnings = check_query(query)
+            problems += query_problems
+            for warning in warnings:
+                print(f"[*] {warning}")
+            if not query_problems:
+                print(f"[v] {query.name}")
+
+    for problem in problems:
+        print(f"[!] {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,106 @@ SUB_HEX_SIZE = 9
 
 REVIEWS_TOO_OLD_MONTHS = 48
 TOO_MANY_PAGES = 200
+# pages fetched through one VPN before changing it
+PAGES_PER_VPN = 10
 
 PAGE_STATUS_EXPIRATION = 60 * 60 * 24  # 1 day
 RAW_PAGE_EXPIRATION_S = 3600 * 24 * 14
 GOOGLE_ERROR = "Our systems have detected unusual traffic from your computer network."
 
 # scraping tags
-GMAPS_NEXT_PAGE_TOKEN = 'data-next-page-token="(\w+\=+)' # noqa S105
+# prettified pages always quote attributes with ", raw google responses may not
+GMAPS_NEXT_PAGE_TOKEN = r'data-next-page-token=["\']?(\w+=+)' # noqa S105
+
+# html parsing
+# parser backends for BeautifulSoup, picked by the `html_parser` env variable.
+# lxml is C-backed and much faster, but optional, so html.parser stays the default.
+DEFAULT_HTML_PARSER = "html.parser"
+HTML_PARSER_BACKENDS = ("html.parser", "lxml")
+
+# "global" zips per-field find_all's over the page, "per_block" reads each review container once
+DEFAULT_EXTRACTION_MODE = "global"
+EXTRACTION_MODES = ("global", "per_block")
+NAME_CLASS = "TSUbDb"
+TIME_CLASS = "PuaHbe"
+
+# reparse of raw pages
+REPARSE_CHUNK_SIZE = 50  # pages per process pool task
+REPARSE_MAX_IN_FLIGHT = 8  # chunks read but not yet stored
+
+# "raw" keeps google's response text, "prettified" stores BeautifulSoup.prettify output.
+# prettified stays the default: reviewer names made of several text nodes keep prettify's
+# indentation, and unique_review_id hashes them, so raw mode gives stored reviews new ids
+DEFAULT_PAGE_FETCH_MODE = "prettified"
+PAGE_FETCH_MODES = ("raw", "prettified")
+
+# http session for google review pages
+GOOGLE_REQUEST_TIMEOUT_S = 30
+# "default" keeps the headers of python-requests, "browser" sends GOOGLE_REQUEST_HEADERS
+DEFAULT_GOOGLE_HEADERS_MODE = "default"
+GOOGLE_HEADERS_MODES = ("default", "browser")
+GOOGLE_REQUEST_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36"
+    ),
+    "Accept": "*/*",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+# "pipelined" stores pages in the background and paces from the fetch, "sequential" does it all in line
+DEFAULT_SCRAPE_PIPELINE = "pipelined"
+SCRAPE_PIPELINES = ("sequential", "pipelined")
+
+# write-behind buffer of scraped pages: flush when either is reached
+WRITE_BEHIND_MAX_PAGES = 5
+WRITE_BEHIND_MAX_AGE_S = 60
+
+# compression of raw pages in Cosmos, see page_codec.py
+DEFAULT_PAGE_CODEC = "zlib"
+
+# per place set of review ids already in mongo, see read_raw_reviews.get_known_reviews
+# ids are truncated to this many hex chars (64 bits), plenty to tell apart the reviews of one place
+KNOWN_REVIEW_ID_CHARS = 16
+KNOWN_REVIEWS_EXPIRATION_S = 3600 * 24 * 180
+# pagination stops on a page that has at least this share of known reviews
+KNOWN_REVIEWS_STOP_SHARE = 0.5
+
+# pacing between pages, see rate_governor.py. Rates in pages per minute.
+DEFAULT_PACING_POLICY = "fixed"
+PACING_POLICIES = {
+    "adaptive": {
+        "initial_rate": 6,
+        "min_rate": 1,
+        "max_rate": 20,
+        "worker_rate": 12,
+        "burst": 1,
+        "increase": 0.25,
+        # RateLimitedError is a 403 / 429 / 503 from google without a block page,
+        # a plain ChangeVPNError comes from our own page counter and doesn't slow down
+        "outcome_factors": {
+            "EmptyPageError": 0.5, "NoReviewsError": 0.5, "RateLimitedError": 0.5, "GoogleKnowsError": 0.25
+        },
+        "jitter_s": 2,
+    },
+    "cautious": {
+        "initial_rate": 4,
+        "min_rate": 0.5,
+        "max_rate": 8,
+        "worker_rate": 6,
+        "burst": 1,
+        "increase": 0.1,
+        "outcome_factors": {
+            "EmptyPageError": 0.5, "NoReviewsError": 0.5, "RateLimitedError": 0.4, "GoogleKnowsError": 0.2
+        },
+        "jitter_s": 4,
+    },
+}
+RATE_BUCKET_EXPIRATION_S = 3600 * 24 * 7
+
+# response classification before parsing, see response_classifier.py
+BLOCKED_MARKERS = (GOOGLE_ERROR.encode("utf-8"), b"/sorry/index", b'id="captcha-form"')
+BLOCKED_URL_MARKER = "/sorry/"
+# _assert_if_extracted's threshold
+EMPTY_PAGE_MAX_BYTES = 100
@@ -0,0 +1,163 @@
+"""
+Local stand-in for google's async/reviewDialog endpoint, to run the scraper without google.
+Pages are served from saved fixture pages (the review_corpus layout), chained by
+data-next-page-token, for any data_id. Latency, empty pages and the "unusual traffic" page
+can be injected.
+
+usage:
+    python descobridor/discovery/fake_google.py --corpus corpus --port 8765 --latency 0.2
+    # then point the scraper at it
+    google_base_url = "http://127.0.0.1:8765"
+"""
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from descobridor.discovery.constants import GOOGLE_ERROR
+from descobridor.discovery.review_corpus import DEFAULT_CORPUS_DIR
+
+
+TOKEN_ATTRIBUTE = re.compile(r'data-next-page-token=["\']?\w*=*["\']?')
+ASYNC_FIELDS = re.compile(r'(\w+):([^,]*)')
+BLOCKED_PAGE = f"<html><body><div>{GOOGLE_ERROR}</div></body></html>"
+EMPTY_PAGE = "<html></html>"
+
+
+class FakeGoogleConfig(NamedTuple):
+    # pages of each place, the last one has no next page token
+    pages_per_place: int = 20
+    # seconds before each response
+    latency_s: float = 0.0
+    # share of the responses that are an empty page / the unusual traffic page
+    empty_rate: float = 0.0
+    block_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+def page_token(page_number: int) -> str:
+    return f"FAKE{page_number}TOKEN=="
+
+
+def token_page_number(token: str) -> int:
+    if not token:
+        return 0
+    return int(token[len("FAKE"):-len("TOKEN==")])
+
+
+def with_next_page_token(page: str, token: str) -> str:
+    token_div = f'<div data-next-page-token="{token}"></div>'
+    if "</body>" in page:
+        return page.replace("</body>", f"{token_div}</body>", 1)
+    return page + token_div
+
+
+def load_fixture_pages(corpus_dir: Path) -> Dict[str, List[str]]:
+    """
+    :returns: {language: [page html]}, the pages without their next page token
+    """
+    fixtures: Dict[str, List[str]] = {}
+    for html_path in sorted(Path(corpus_dir).glob("*/*.html")):
+        page = TOKEN_ATTRIBUTE.sub("", html_path.read_text())
+        fixtures.setdefault(html_path.parent.name, []).append(page)
+    if not fixtures:
+        raise FileNotFoundError(f"No fixture pages in {corpus_dir}")
+    return fixtures
+
+
+class FakeGoogle:
+    """
+    :param fixtures: {language: [page html]}, page n of every place is fixture n modulo their number
+    """
+    def __init__(self, fixtures: Dict[str, List[str]], config: Optional[FakeGoogleConfig] = None):
+        self.fixtures = fixtures
+        self.config = config or FakeGoogleConfig()
+        self._random = random.Random(self.config.seed)  # noqa: S311 test stand-in, not crypto
+        self._lock = threading.Lock()
+        self.served = {"pages": 0, "empty": 0, "blocked": 0, "not_found": 0}
+
+    def respond(self, path: str) -> Tuple[int, str]:
+        url = urlparse(path)
+        if url.path != "/async/reviewDialog":
+            return self._count(404, "", "not_found")
+        query = parse_qs(url.query)
+        language = query.get("hl", ["en"])[0]
+        fields = dict(ASYNC_FIELDS.findall(query.get("async", [""])[0]))
+        if language not in self.fixtures or "feature_id" not in fields:
+            return self._count(404, "", "not_found")
+
+        time.sleep(self.config.latency_s)
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.config.block_rate:
+            return self._count(200, BLOCKED_PAGE, "blocked")
+        if draw < self.config.block_rate + self.config.empty_rate:
+            return self._count(200, EMPTY_PAGE, "empty")
+
+        page_number = token_page_number(fields.get("next_page_token", ""))
+        pages = self.fixtures[language]
+        page = pages[page_number % len(pages)]
+        if page_number + 1 < self.config.pages_per_place:
+            page = with_next_page_token(page, page_token(page_number + 1))
+        return self._count(200, page, "pages")
+
+    def _count(self, status: int, body: str, outcome: str) -> Tuple[int, str]:
+        with self._lock:
+            self.served[outcome] += 1
+        return status, body
+
+    def make_server(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        """
+        port 0 picks a free one, see server.server_address
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = fake.respond(self.path)
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=UTF-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+    def serve_in_background(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        server = self.make_server(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS_DIR)
+    args.add_argument("--host", default="127.0.0.1")
+    args.add_argument("--port", type=int, default=8765)
+    args.add_argument("--pages-per-place", type=int, default=20)
+    args.add_argument("--latency", type=float, default=0.0)
+    args.add_argument("--empty-rate", type=float, default=0.0)
+    args.add_argument("--block-rate", type=float, default=0.0)
+    args.add_argument("--seed", type=int)
+    arguments = args.parse_args()
+
+    config = FakeGoogleConfig(
+        arguments.pages_per_place, arguments.latency, arguments.empty_rate, arguments.block_rate,
+        arguments.seed)
+    fake_google = FakeGoogle(load_fixture_pages(arguments.corpus), config)
+    server = fake_google.make_server(arguments.host, arguments.port)
+    print(f"serving review pages on http://{arguments.host}:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
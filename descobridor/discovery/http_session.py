@@ -0,0 +1,76 @@
+import os
+import threading
+from typing import Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+from descobridor.discovery.constants import (
+    GOOGLE_REQUEST_HEADERS,
+    DEFAULT_GOOGLE_HEADERS_MODE,
+    GOOGLE_HEADERS_MODES,
+    )
+from descobridor.the_logger import logger
+
+
+def get_headers_mode() -> str:
+    """
+    default: the headers python-requests sends, as the scraper always did.
+    browser: GOOGLE_REQUEST_HEADERS, a fixed desktop Chrome User-Agent.
+    Picked by the `google_request_headers` env variable.
+    """
+    mode = os.environ.get("google_request_headers", DEFAULT_GOOGLE_HEADERS_MODE)
+    if mode not in GOOGLE_HEADERS_MODES:
+        raise ValueError(f"Headers mode {mode} not supported, use one of {GOOGLE_HEADERS_MODES}")
+    return mode
+
+
+class ReviewSessionManager:
+    """
+    Keeps one requests.Session for the worker's current VPN tunnel,
+    so that pages of a place reuse the keep-alive connection (no TCP + TLS setup per page)
+    and look like one client: same headers, cookies carried from page to page.
+    Connections opened through one tunnel are useless after a VPN switch,
+    so the worker has to reset the session whenever it changes VPN.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+        self._tunnel: Optional[str] = None
+
+    def get(self, tunnel: Optional[str] = None) -> requests.Session:
+        """
+        :param tunnel: id of the current VPN tunnel, if given and different from
+            the one the session was opened in, the session is rebuilt
+        """
+        with self._lock:
+            if self._session is not None and tunnel is not None and tunnel != self._tunnel:
+                self._close()
+            if self._session is None:
+                self._session = self._new_session()
+                self._tunnel = tunnel
+            return self._session
+
+    def reset(self) -> None:
+        with self._lock:
+            self._close()
+
+    def _close(self) -> None:
+        if self._session is not None:
+            logger.info(f" [*] Closing http session of tunnel {self._tunnel}")
+            self._session.close()
+        self._session = None
+        self._tunnel = None
+
+    @staticmethod
+    def _new_session() -> requests.Session:
+        session = requests.Session()
+        if get_headers_mode() == "browser":
+            session.headers.update(GOOGLE_REQUEST_HEADERS)
+        # a single host, and no silent retries: a failure has to reach the VPN logic
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+
+session_manager = ReviewSessionManager()
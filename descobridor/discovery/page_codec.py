@@ -0,0 +1,225 @@
+"""
+Compact storage format of raw pages in Cosmos raw_reviews.
+A stored page has:
+    content: compressed bytes (or the plain string for the "none" codec and old records)
+    content_codec: which codec compressed it, old records don't have it
+    content_minified: whether indentation was stripped before compressing
+Every reader goes through page_content(), which decompresses transparently.
+
+usage:
+    # size and throughput of each codec on a sample of stored pages
+    python descobridor/discovery/page_codec.py bench --limit 200
+    # recompress stored pages with the configured codec
+    python descobridor/discovery/page_codec.py migrate --codec zlib
+"""
+import argparse
+import bz2
+import importlib.util
+import itertools
+import json
+import lzma
+import os
+import re
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from descobridor.discovery.constants import DEFAULT_PAGE_CODEC
+
+
+INDENTATION = re.compile(r"\n\s+")
+
+
+def _zstd_codec() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    import zstandard
+    return zstandard.ZstdCompressor(level=10).compress, zstandard.ZstdDecompressor().decompress
+
+
+def _brotli_codec() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    import brotli
+    return (lambda data: brotli.compress(data, quality=9)), brotli.decompress
+
+
+# name: (compress, decompress) on utf-8 bytes
+CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (lambda data: zlib.compress(data, 9), zlib.decompress),
+    "bz2": (bz2.compress, bz2.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+# optional codecs, only if their package is installed
+for (_name, _module, _codec) in (("zstd", "zstandard", _zstd_codec), ("brotli", "brotli", _brotli_codec)):
+    if importlib.util.find_spec(_module) is not None:
+        CODECS[_name] = _codec()
+PLAIN = "none"
+
+
+def get_page_codec() -> str:
+    """
+    picked by the `raw_page_codec` env variable
+    """
+    codec = os.environ.get("raw_page_codec", DEFAULT_PAGE_CODEC)
+    if codec != PLAIN and codec not in CODECS:
+        raise ValueError(f"Page codec {codec} not available, use one of {[PLAIN, *CODECS]}")
+    return codec
+
+
+def is_minify_enabled() -> bool:
+    return os.environ.get("raw_page_minify", "false").lower() == "true"
+
+
+def minify(content: str) -> str:
+    """
+    drops indentation, which is most of what prettify adds.
+    Whitespace inside some fields (eg. reviewer names with several text nodes) can change,
+    `bench` checks how many pages still parse to the same reviews.
+    """
+    return INDENTATION.sub("\n", content)
+
+
+def encode_content(
+    content: str,
+    codec: Optional[str] = None,
+    minified: Optional[bool] = None
+    ) -> Dict[str, Any]:
+    """
+    :returns: the content fields of a stored page record
+    """
+    codec = codec or get_page_codec()
+    minified = is_minify_enabled() if minified is None else minified
+    if minified:
+        content = minify(content)
+    if codec == PLAIN:
+        encoded: Union[str, bytes] = content
+    else:
+        compress, _ = CODECS[codec]
+        encoded = compress(content.encode('utf-8'))
+    return {'content': encoded, 'content_codec': codec, 'content_minified': minified}
+
+
+def page_content(record: Dict[str, Any]) -> str:
+    """
+    html of a page record, whichever way it was stored
+    """
+    codec = record.get('content_codec', PLAIN)
+    content = record['content']
+    if codec == PLAIN:
+        return content if isinstance(content, str) else bytes(content).decode('utf-8')
+    try:
+        _, decompress = CODECS[codec]
+    except KeyError:
+        raise ValueError(f"Page stored with codec {codec}, which is not installed") from None
+    return decompress(bytes(content)).decode('utf-8')
+
+
+def encode_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    a copy of an in-memory page record ready to be stored
+    """
+    return {**record, **encode_content(record['content'])}
+
+
+### migration and benchmark tool ###
+
+def load_sample(limit: int, dump: Optional[Path]) -> List[Dict[str, Any]]:
+    if dump:
+        with open(dump) as f:
+            return [json.loads(line) for line in itertools.islice(f, limit)]
+    from truby.db_connection import CosmosConnection
+    with CosmosConnection("raw_reviews") as conn:
+        return list(conn.collection.find({}).limit(limit))
+
+
+def _same_reviews(original: str, minified: str, record: Dict[str, Any]) -> bool:
+    from descobridor.discovery import review_parser as rp
+    language = record['scrape_language']
+    before = rp.get_page_reviews({**record, 'content': original, 'content_codec': PLAIN}, language)
+    after = rp.get_page_reviews({**record, 'content': minified, 'content_codec': PLAIN}, language)
+    return before.equals(after)
+
+
+def bench(records: List[Dict[str, Any]], check_minified: bool = True) -> List[Dict[str, Any]]:
+    pages = [page_content(record) for record in records]
+    raw_bytes = sum(len(page.encode('utf-8')) for page in pages)
+    results = []
+    for minified in (False, True):
+        inputs = [minify(page) if minified else page for page in pages]
+        for codec in (PLAIN, *CODECS):
+            start = time.perf_counter()
+            encoded = [encode_content(page, codec, minified=False) for page in inputs]
+            encode_s = time.perf_counter() - start
+            start = time.perf_counter()
+            for enc in encoded:
+                page_content(enc)
+            decode_s = time.perf_counter() - start
+            stored_bytes = sum(
+                len(enc['content'].encode('utf-8')) if codec == PLAIN else len(enc['content'])
+                for enc in encoded
+            )
+            results.append({
+                'codec': codec,
+                'minified': minified,
+                'pages': len(pages),
+                'stored_mb': stored_bytes / 1e6,
+                'ratio': raw_bytes / stored_bytes if stored_bytes else None,
+                'encode_mb_s': raw_bytes / 1e6 / encode_s if encode_s else None,
+                'decode_mb_s': raw_bytes / 1e6 / decode_s if decode_s else None,
+            })
+    if check_minified:
+        same = sum(
+            _same_reviews(page, minify(page), record) for (page, record) in zip(pages, records, strict=True)
+        )
+        print(f"minified pages with the same reviews: {same}/{len(pages)}")
+    return results
+
+
+def migrate(codec: str, minified: bool, batch_size: int) -> int:
+    """
+    recompresses stored pages that don't use `codec` yet
+    :returns: number of migrated pages
+    """
+    from pymongo import UpdateOne
+    from truby.db_connection import CosmosConnection
+    migrated = 0
+    with CosmosConnection("raw_reviews") as conn:
+        cursor = conn.collection.find({'content_codec': {'$ne': codec}}, {'content', 'content_codec'})
+        updates = []
+        for record in cursor:
+            fields = encode_content(page_content(record), codec, minified)
+            updates.append(UpdateOne({'_id': record['_id']}, {'$set': fields}))
+            if len(updates) >= batch_size:
+                migrated += conn.collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            migrated += conn.collection.bulk_write(updates, ordered=False).modified_count
+    return migrated
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    commands = args.add_subparsers(dest="command", required=True)
+    bench_args = commands.add_parser("bench", help="size and throughput per codec")
+    bench_args.add_argument("--limit", type=int, default=200)
+    bench_args.add_argument("--dump", type=Path, help="json lines dump of raw pages instead of Cosmos")
+    bench_args.add_argument("--output", type=Path, help="where to write the json results")
+    migrate_args = commands.add_parser("migrate", help="recompress stored pages")
+    migrate_args.add_argument("--codec", default=None)
+    migrate_args.add_argument("--minify", action="store_true")
+    migrate_args.add_argument("--batch-size", type=int, default=100)
+    arguments = args.parse_args()
+
+    if arguments.command == "bench":
+        results = bench(load_sample(arguments.limit, arguments.dump))
+        for result in results:
+            print(f"{result['codec']:>7} minified={result['minified']!s:>5}: "
+                  f"{result['stored_mb']:.2f} MB, ratio {result['ratio']:.1f}, "
+                  f"encode {result['encode_mb_s']:.1f} MB/s, decode {result['decode_mb_s']:.1f} MB/s")
+        if arguments.output:
+            arguments.output.write_text(json.dumps(results, indent=2))
+    elif arguments.command == "migrate":
+        codec = arguments.codec or get_page_codec()
+        print(f"migrated {migrate(codec, arguments.minify, arguments.batch_size)} pages to {codec}")
+
+
+if __name__ == "__main__":
+    main()
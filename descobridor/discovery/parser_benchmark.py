@@ -0,0 +1,95 @@
+"""
+compares html parser backends and extraction modes of review_parser
+on real saved review pages,
+eg. the pn{name}_{page}.html dumps of extract_all_reviews.
+usage:
+    python descobridor/discovery/parser_benchmark.py --language es pages/*.html
+"""
+import argparse
+import time
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List
+import pandas as pd
+
+from descobridor.discovery import review_parser as rp
+from descobridor.discovery.constants import HTML_PARSER_BACKENDS, EXTRACTION_MODES
+
+
+def load_saved_page(path: Path) -> Dict[str, Any]:
+    """
+    a saved page is only the html content,
+    the rest of the page record is filled with placeholders
+    """
+    return {
+        'place_id': path.stem,
+        'data_id': path.stem,
+        'name': path.stem,
+        'scrape_ds': str(date.today()),
+        'content': path.read_text(),
+    }
+
+
+def benchmark_parser(
+    page_records: List[Dict[str, Any]],
+    language: str,
+    backend: str,
+    mode: str,
+    repeat: int
+    ) -> Dict[str, Any]:
+    """
+    :returns: timings of get_page_reviews with a given backend and mode
+        and the reviews of the last run, to compare the output
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        reviews = [rp.get_page_reviews(record, language, backend, mode) for record in page_records]
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        'parser': f"{backend}/{mode}",
+        'pages': len(page_records),
+        'reviews': sum(len(r) for r in reviews),
+        'best_s': best,
+        'pages_per_s': len(page_records) / best,
+        'output': reviews,
+    }
+
+
+def outputs_match(reference: List[pd.DataFrame], other: List[pd.DataFrame]) -> bool:
+    if len(reference) != len(other):
+        return False
+    for (ref_df, other_df) in zip(reference, other, strict=True):
+        try:
+            pd.testing.assert_frame_equal(ref_df, other_df)
+        except AssertionError:
+            return False
+    return True
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("pages", nargs="+", type=Path, help="saved html review pages")
+    args.add_argument("--language", required=True)
+    args.add_argument("--backends", nargs="+", default=HTML_PARSER_BACKENDS)
+    args.add_argument("--modes", nargs="+", default=EXTRACTION_MODES)
+    args.add_argument("--repeat", type=int, default=3)
+    arguments = args.parse_args()
+
+    page_records = [load_saved_page(path) for path in arguments.pages]
+    results = [
+        benchmark_parser(page_records, arguments.language, backend, mode, arguments.repeat)
+        for backend in arguments.backends
+        for mode in arguments.modes
+    ]
+    reference = results[0]
+    for result in results:
+        same = outputs_match(reference['output'], result['output'])
+        print(f"{result['parser']:>22}: {result['pages']} pages, {result['reviews']} reviews, "
+              f"{result['best_s']:.3f} s, {result['pages_per_s']:.1f} pages/s, "
+              f"same output as {reference['parser']}: {same}")
+
+
+if __name__ == "__main__":
+    main()
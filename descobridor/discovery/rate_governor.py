@@ -0,0 +1,177 @@
+"""
+Pacing of google requests between the pages of a place.
+
+policies (env variable `pacing_policy`):
+    fixed: the historical random sleep, no coordination between workers
+    adaptive, cautious: redis token buckets, one per VPN endpoint shared by all the workers
+        that go out through it, and one per worker. The VPN rate is tuned from what google answers:
+        it grows a little after every good page and is cut on empty pages and blocks (AIMD),
+        so we run close to the blocking threshold instead of at a fixed conservative rate.
+"""
+import os
+import time
+from typing import Dict, NamedTuple, Optional
+import numpy as np
+
+from truby.db_connection import RedisConnection
+from descobridor.discovery.constants import (
+    DEFAULT_PACING_POLICY,
+    PACING_POLICIES,
+    RATE_BUCKET_EXPIRATION_S,
+    )
+from descobridor.the_logger import logger
+
+
+# reserves a token, the bucket can go negative: the caller waits until it's back to zero.
+# KEYS[1]: bucket hash, ARGV: now (s), initial rate (tokens/s), capacity, expiration (s)
+# returns the wait in seconds, as a string because redis truncates lua numbers to integers
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate') or ARGV[2])
+local capacity = tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or capacity)
+local ts = tonumber(redis.call('HGET', KEYS[1], 'ts') or now)
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - 1
+redis.call('HSET', KEYS[1], 'rate', rate, 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+if tokens >= 0 then
+    return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# multiplies the rate by ARGV[1] if it's below 1, otherwise adds ARGV[2], within [ARGV[3], ARGV[4]]
+# KEYS[1]: bucket hash, ARGV: factor, increase, min rate, max rate, initial rate, expiration (s)
+ADJUST_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate') or ARGV[5])
+local factor = tonumber(ARGV[1])
+if factor < 1 then
+    rate = rate * factor
+else
+    rate = rate + tonumber(ARGV[2])
+end
+rate = math.max(tonumber(ARGV[3]), math.min(tonumber(ARGV[4]), rate))
+redis.call('HSET', KEYS[1], 'rate', rate)
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return tostring(rate)
+"""
+
+
+def pacing_wait() -> float:
+    """
+    how long to wait between two pages of a place, in seconds
+    """
+    return max(np.random.beta(2, 2) * 2.5 + 2.5, np.random.gamma(5, 2))
+
+
+class PacingPolicy(NamedTuple):
+    """
+    rates are in pages per minute
+    """
+    initial_rate: float
+    min_rate: float
+    max_rate: float
+    # rate of a single worker, whatever its VPN allows
+    worker_rate: float
+    # bucket size, how many pages can go out back to back after a pause
+    burst: float
+    # added to the VPN rate after each good page
+    increase: float
+    # the VPN rate is multiplied by these, 1 leaves it as it is
+    outcome_factors: Dict[str, float]
+    # random extra wait, up to this many seconds, so that the pages don't come at a regular beat
+    jitter_s: float
+
+
+def get_pacing_policy(name: Optional[str] = None) -> Optional[PacingPolicy]:
+    """
+    picked by the `pacing_policy` env variable
+    :returns: None for the fixed policy
+    """
+    name = name or os.environ.get("pacing_policy", DEFAULT_PACING_POLICY)
+    if name == "fixed":
+        return None
+    if name not in PACING_POLICIES:
+        raise ValueError(f"Pacing policy {name} not supported, use one of {['fixed', *PACING_POLICIES]}")
+    return PacingPolicy(**PACING_POLICIES[name])
+
+
+class RateGovernor:
+    """
+    Decides how long to wait before the next page, and learns from how pages went.
+    :param worker: name of the worker, for its own bucket
+    :param vpn: VPN endpoint the worker goes out through, workers on the same one share a bucket
+    :param policy: None for the fixed pacing
+    """
+    def __init__(
+        self,
+        worker: Optional[str] = None,
+        vpn: Optional[str] = None,
+        policy: Optional[PacingPolicy] = None
+        ):
+        self.worker = worker or os.environ.get("worker_name", "worker")
+        self.vpn = vpn
+        self.policy = policy
+
+    @classmethod
+    def from_env(cls, worker: Optional[str] = None, vpn: Optional[str] = None) -> "RateGovernor":
+        return cls(worker, vpn, get_pacing_policy())
+
+    @property
+    def worker_key(self) -> str:
+        return f"rate_bucket_worker_{self.worker}"
+
+    @property
+    def vpn_key(self) -> Optional[str]:
+        return f"rate_bucket_vpn_{self.vpn}" if self.vpn else None
+
+    def wait(self) -> float:
+        """
+        reserves the next page in the buckets
+        :returns: seconds to wait before fetching it
+        """
+        policy = self.policy
+        if policy is None:
+            return pacing_wait()
+        now = time.time()
+        try:
+            with RedisConnection() as redis:
+                acquire = redis.connection.register_script(ACQUIRE_SCRIPT)
+                waits = [float(acquire(
+                    keys=[self.worker_key],
+                    args=[now, policy.worker_rate / 60, policy.burst, RATE_BUCKET_EXPIRATION_S]
+                ))]
+                if self.vpn_key:
+                    waits.append(float(acquire(
+                        keys=[self.vpn_key],
+                        args=[now, policy.initial_rate / 60, policy.burst, RATE_BUCKET_EXPIRATION_S]
+                    )))
+        except Exception as e:
+            logger.error(f" [!] rate governor unavailable, using the fixed pacing: {e!r}")
+            return pacing_wait()
+        return max(waits) + np.random.beta(2, 2) * policy.jitter_s
+
+    def observe(self, error: Optional[Exception] = None) -> None:
+        """
+        adjusts the VPN rate after a page
+        :param error: what the page raised, None for a good page
+        """
+        policy = self.policy
+        if policy is None or not self.vpn_key:
+            return
+        outcome = "success" if error is None else type(error).__name__
+        factor = policy.outcome_factors.get(outcome, 1.0)
+        if outcome != "success" and factor == 1.0:
+            return
+        try:
+            with RedisConnection() as redis:
+                adjust = redis.connection.register_script(ADJUST_SCRIPT)
+                rate = float(adjust(keys=[self.vpn_key], args=[
+                    factor, policy.increase / 60, policy.min_rate / 60, policy.max_rate / 60,
+                    policy.initial_rate / 60, RATE_BUCKET_EXPIRATION_S
+                ]))
+        except Exception as e:
+            logger.error(f" [!] rate governor could not record {outcome}: {e!r}")
+            return
+        if outcome != "success":
+            logger.warning(f" [*] {outcome} on {self.vpn}, rate down to {rate * 60:.2f} pages/min")
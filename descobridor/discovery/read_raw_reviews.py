@@ -1,38 +1,108 @@
+import os
 import re
-from typing import Any, Dict, Tuple
-import numpy as np
-import requests
+import json
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 from datetime import date, datetime
 import pandas as pd 
 import time
+import requests
 from bs4 import BeautifulSoup
 
 from truby.db_connection import MongoConnection, CosmosConnection, RedisConnection
 from descobridor.discovery import review_parser as rp
 from descobridor.discovery.constants import (
     TOO_MANY_PAGES, 
+    PAGES_PER_VPN,
     REVIEWS_TOO_OLD_MONTHS,
     GMAPS_NEXT_PAGE_TOKEN,
     PAGE_STATUS_EXPIRATION,
     RAW_PAGE_EXPIRATION_S,
     GOOGLE_ERROR,
+    DEFAULT_PAGE_FETCH_MODE,
+    PAGE_FETCH_MODES,
+    GOOGLE_REQUEST_TIMEOUT_S,
+    DEFAULT_SCRAPE_PIPELINE,
+    SCRAPE_PIPELINES,
+    WRITE_BEHIND_MAX_PAGES,
+    WRITE_BEHIND_MAX_AGE_S,
+    KNOWN_REVIEW_ID_CHARS,
+    KNOWN_REVIEWS_EXPIRATION_S,
+    KNOWN_REVIEWS_STOP_SHARE,
     )
+from descobridor.discovery.http_session import session_manager
+from descobridor.discovery.page_codec import encode_record
+from descobridor.discovery.rate_governor import RateGovernor
+from descobridor.discovery import response_classifier as rc
+from descobridor.discovery.stage_timer import stage_timer
 from descobridor.the_logger import logger
 
 
+NEXT_PAGE_TOKEN_PATTERN = re.compile(GMAPS_NEXT_PAGE_TOKEN)
+
+
 def get_language_related_g_header(country_domain: str, language: str):
-    return f"https://www.google.{country_domain}/async/reviewDialog?hl={language}&async=feature_id"
+    """
+    the `google_base_url` env variable points the scraper somewhere else, eg. to fake_google.py
+    """
+    base_url = os.environ.get("google_base_url") or f"https://www.google.{country_domain}"
+    return f"{base_url}/async/reviewDialog?hl={language}&async=feature_id"
+
 
+def get_response_from_google(link: str) -> requests.Response:
+    session = session_manager.get()
+    return session.get(link, timeout=GOOGLE_REQUEST_TIMEOUT_S)
 
-def get_review_page_from_google(link: str) -> str:
-    session = requests.Session()
-    response = session.get(link)
-    soup = BeautifulSoup(response.text, "html.parser")
+
+def prettify_page(page_str: str) -> bytes:
+    soup = BeautifulSoup(page_str, "html.parser")
     return soup.prettify('utf-8')
 
 
+def check_response(response: requests.Response) -> None:
+    """
+    raises the VPN rotation errors for responses that are not worth parsing
+    """
+    label = rc.classify_response(response.status_code, response.headers, response.content, response.url)
+    stage_timer.count(f"response_{label}")
+    if label == rc.OK:
+        return
+    logger.critical(f"{label} response, status {response.status_code}, {len(response.content)} bytes")
+    if label == rc.BLOCKED:
+        raise GoogleKnowsError("google knows")
+    if label == rc.RATE_LIMITED:
+        raise RateLimitedError(f"rate limited, status {response.status_code}")
+    raise EmptyPageError(f"empty response, status {response.status_code}")
+
+
+def get_page_fetch_mode() -> str:
+    """
+    raw mode keeps google's response as is: the page is parsed only once, for review extraction.
+    prettified mode is the old behaviour: parse, prettify, decode, and parse again later.
+    Reviewer names don't get prettify's whitespace in raw mode, so some unique_review_ids
+    differ from the stored ones: don't switch a running deployment to raw.
+    Picked by the `page_fetch_mode` env variable.
+    """
+    mode = os.environ.get("page_fetch_mode", DEFAULT_PAGE_FETCH_MODE)
+    if mode not in PAGE_FETCH_MODES:
+        raise ValueError(f"Page fetch mode {mode} not supported, use one of {PAGE_FETCH_MODES}")
+    return mode
+
+
+def fetch_page_str(link: str) -> str:
+    response = get_response_from_google(link)
+    check_response(response)
+    if get_page_fetch_mode() == "prettified":
+        return binary_page_to_str(prettify_page(response.text))
+    return response.text
+
+
 def get_next_page_token(page_str: str) -> str:
-    return re.findall(GMAPS_NEXT_PAGE_TOKEN, page_str)[0]
+    match = NEXT_PAGE_TOKEN_PATTERN.search(page_str)
+    if match is None:
+        raise IndexError("no next page token on the page")
+    return match.group(1)
 
 
 def format_query_page(
@@ -96,12 +166,39 @@ def make_page_record(
     
     
 def store_page(record: Dict[str, Any]) -> None:
+    """
+    the content is stored compressed, see page_codec
+    """
+    record = encode_record(record)
     record['ttl'] = RAW_PAGE_EXPIRATION_S
     with CosmosConnection("raw_reviews") as conn:
         conn.collection.insert_one(record)
     return record
 
 
+def store_pages(records: List[Dict[str, Any]]) -> None:
+    """
+    one unordered bulk insert for several pages, compressed as in store_page
+    """
+    records = [encode_record(record) for record in records]
+    for record in records:
+        record['ttl'] = RAW_PAGE_EXPIRATION_S
+    with CosmosConnection("raw_reviews") as conn:
+        conn.collection.insert_many(records, ordered=False)
+
+
+def dump_page(page_record: Dict[str, Any]) -> None:
+    """
+    keeps a page we couldn't get reviews from, with its record next to it,
+    so that it can be turned into a parser corpus case (see review_corpus.py)
+    """
+    dump_name = f"pn{page_record['name']}_{page_record['page_number']}"
+    with open(f"{dump_name}.html", 'w') as f:
+        f.write(page_record['content'])
+    with open(f"{dump_name}.json", 'w') as f:
+        json.dump({k: v for k, v in page_record.items() if k != 'content'}, f)
+
+
 def _assert_if_extracted(page_str, page_number) -> None:
     if len(page_str) > 100:
         logger.info(f"page {page_number} extracted from google")
@@ -116,8 +213,8 @@ def process_page(request: Dict[str, Any], page_number: int, next_page_token: str
     """
     link = format_query_page(request['data_id'], next_page_token, 
                                  request['country_domain'], request['language'])
-    raw_google_output = get_review_page_from_google(link)
-    page_str = binary_page_to_str(raw_google_output)
+    with stage_timer.timed("fetch"):
+        page_str = fetch_page_str(link)
     _assert_if_extracted(page_str, page_number)
     try:
         next_page_token = get_next_page_token(page_str)
@@ -152,6 +249,15 @@ def is_stop_condition(reviews, next_page_token: str, last_scraped: datetime) ->
     )
 
 
+def known_share(reviews: pd.DataFrame, known: Set[str]) -> float:
+    """
+    share of the page's reviews that are already stored
+    """
+    if not known or reviews.empty:
+        return 0.0
+    return reviews.unique_review_id.str[:KNOWN_REVIEW_ID_CHARS].isin(known).mean()
+
+
 def get_last_scraped(request: Dict[str, Any]) -> datetime:
     last_scraped = pd.to_datetime(request['last_scraped'])
     if last_scraped is None:
@@ -160,21 +266,132 @@ def get_last_scraped(request: Dict[str, Any]) -> datetime:
         return last_scraped.normalize()
     
     
-def _successful_page_key(request: Dict[str, Any]) -> str:
-    return f"{request['place_id']}_{request['language']}_page"
-    
-def successful_page_to_redis(request: Dict[str, Any], page_number: int):
+def _checkpoint_key(request: Dict[str, Any]) -> str:
+    return f"{request['place_id']}_{request['language']}_checkpoint"
+
+
+def checkpoint_to_redis(
+    request: Dict[str, Any],
+    page_number: int,
+    next_page_token: Optional[str],
+    review_ids: Optional[List[str]] = None,
+    watermark: Optional[str] = None
+    ) -> None:
     """
-    stores the numbero of the page that was successfully scraped.
+    stores everything needed to resume a place in one hash, in a single round trip:
+    the last successfully stored page, the token of the page after it,
+    and the watermark, the date of the oldest review stored so far.
+    The ids of the stored reviews go to the pending known reviews in the same round trip.
     PAGE_STATUS_EXPIRATION is the time in seconds that the key will be stored in redis.
     It has to be quite a bit, so that in case of failure we could return to this place.
     """
+    key = _checkpoint_key(request)
     with RedisConnection() as redis:
-        redis.connection.set(
-            _successful_page_key(request), 
-            page_number,
-            ex=PAGE_STATUS_EXPIRATION
-            )
+        pipe = redis.connection.pipeline()
+        pipe.hset(key, mapping={
+            'page_number': page_number,
+            'next_page_token': next_page_token or '',
+            'language': request['language'],
+            'watermark': watermark or '',
+        })
+        pipe.expire(key, PAGE_STATUS_EXPIRATION)
+        if review_ids:
+            pending_key = _pending_known_reviews_key(request)
+            pipe.sadd(pending_key, *[i[:KNOWN_REVIEW_ID_CHARS] for i in review_ids])
+            pipe.expire(pending_key, PAGE_STATUS_EXPIRATION)
+        pipe.execute()
+
+
+def clear_checkpoint(request: Dict[str, Any]) -> None:
+    with RedisConnection() as redis:
+        redis.connection.delete(_checkpoint_key(request))
+
+
+def get_checkpoint_from_redis(request: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    with RedisConnection() as redis:
+        checkpoint = redis.connection.hgetall(_checkpoint_key(request))
+    if not checkpoint:
+        return None
+    return {k.decode('utf-8'): v.decode('utf-8') for k, v in checkpoint.items()}
+
+
+def _known_reviews_key(request: Dict[str, Any]) -> str:
+    return f"{request['place_id']}_{request['language']}_known_reviews"
+
+
+def _pending_known_reviews_key(request: Dict[str, Any]) -> str:
+    return f"{request['place_id']}_{request['language']}_known_reviews_pending"
+
+
+def get_known_reviews_from_mongo(request: Dict[str, Any]) -> Set[str]:
+    """
+    the reviews stored up to the last finished scrape of the place (its review_extr_ds),
+    later ones come from a scrape that was interrupted and are not known yet.
+    """
+    with MongoConnection("reviews") as conn:
+        cursor = conn.collection.find(
+            {
+                'place_id': request['place_id'],
+                'language': request['language'],
+                'scrape_ds': {'$lte': request['last_scraped']},
+            },
+            {'unique_review_id': 1, '_id': 0}
+        )
+        return {r['unique_review_id'][:KNOWN_REVIEW_ID_CHARS] for r in cursor}
+
+
+def get_known_reviews(request: Dict[str, Any]) -> Set[str]:
+    """
+    truncated unique_review_ids of the reviews of a place that are already stored.
+    They live in a redis set per place and language,
+    filled from mongo the first time a place that was scraped before comes back.
+    Only reviews of places that were finished are in there (see commit_known_reviews),
+    reviews of an interrupted scrape would make us stop above pages that were never stored.
+    """
+    key = _known_reviews_key(request)
+    with RedisConnection() as redis:
+        known = {i.decode('utf-8') for i in redis.connection.smembers(key)}
+        if known or not request.get('last_scraped'):
+            return known
+        known = get_known_reviews_from_mongo(request)
+        if known:
+            logger.info(f"{len(known)} known reviews of {request['name']} loaded from mongo")
+            pipe = redis.connection.pipeline()
+            pipe.sadd(key, *known)
+            pipe.expire(key, KNOWN_REVIEWS_EXPIRATION_S)
+            pipe.execute()
+    return known
+
+
+def commit_known_reviews(request: Dict[str, Any]) -> None:
+    """
+    moves the reviews stored during this scrape to the known reviews of the place
+    """
+    key = _known_reviews_key(request)
+    pending_key = _pending_known_reviews_key(request)
+    with RedisConnection() as redis:
+        pipe = redis.connection.pipeline()
+        pipe.sunionstore(key, [key, pending_key])
+        pipe.expire(key, KNOWN_REVIEWS_EXPIRATION_S)
+        pipe.delete(pending_key)
+        pipe.execute()
+
+
+def forget_known_reviews(places: Iterable[Dict[str, Any]]) -> None:
+    """
+    drops the known reviews of places whose stored reviews were rewritten, eg. by reparse.
+    They're filled from mongo again the next time the place is scraped.
+    :param places: dicts with place_id and language
+    """
+    keys = [_known_reviews_key(place) for place in places]
+    if not keys:
+        return
+    with RedisConnection() as redis:
+        redis.connection.delete(*keys)
+
+
+def _successful_page_key(request: Dict[str, Any]) -> str:
+    return f"{request['place_id']}_{request['language']}_page"
         
 def get_successful_page_from_redis(request: Dict[str, Any]) -> int:
     with RedisConnection() as redis:
@@ -197,75 +414,280 @@ def get_next_page_token_from_cosmos(request: Dict[str, Any], page_number) -> str
         return ''
     else:
         return record['next_page_token']
+
+
+def is_legacy_checkpoint_lookup_enabled() -> bool:
+    """
+    `legacy_checkpoints`: "true" for PAGE_STATUS_EXPIRATION after upgrading from
+    the page number checkpoints, after that they're all expired and the lookup is a wasted GET.
+    """
+    return os.environ.get("legacy_checkpoints", "false").lower() == "true"
+
+
+def _get_legacy_page_num_and_page_token(request: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+    """
+    checkpoints written before the redis hash existed: page number in redis, token in Cosmos.
+    """
+    page_number = get_successful_page_from_redis(request)
+    if page_number == 0:
+        return 0, ''
+    next_page_token = get_next_page_token_from_cosmos(request, page_number)
+    return page_number + 1, next_page_token
     
 
-def get_page_num_and_page_token(request: Dict[str, Any]) -> Tuple[int, str]:
+def get_page_num_and_page_token(
+    request: Dict[str, Any],
+    checkpoint: Optional[Dict[str, str]]
+    ) -> Tuple[int, Optional[str]]:
     """
     sometimes we have to restart the extraction from a certain page.
     sometimes we start from the beginning.
     This functions determines the page number and the next_page_token
     from where we start.
+    A next_page_token of None means the last page is already stored, there's nothing to resume.
+    :param checkpoint: from get_checkpoint_from_redis
     """
-    page_number = get_successful_page_from_redis(request)
-    next_page_token = get_next_page_token_from_cosmos(request, page_number)
-    if page_number == 0:
+    if checkpoint is None:
+        if is_legacy_checkpoint_lookup_enabled():
+            return _get_legacy_page_num_and_page_token(request)
         return 0, ''
-    else:
-        # + 1 because we want to start from the next page after successful page
-        return page_number + 1, next_page_token
+    if not checkpoint['next_page_token']:
+        # the last stored page was the last one
+        return int(checkpoint['page_number']) + 1, None
+    # + 1 because we want to start from the next page after successful page
+    return int(checkpoint['page_number']) + 1, checkpoint['next_page_token']
      
      
-# this blasted function is too long
-def extract_all_reviews(request: Dict[str, Any]) -> None:
+def is_watermark_past(checkpoint: Optional[Dict[str, str]], last_scraped: datetime) -> bool:
     """
-    :param request: a dictionary with the following keys:
-        place_id: str, 
-        data_id: str
-        country_domain: str
-        language: str,
-        name: str
-        last_scraped: str
+    the pages after a checkpoint hold reviews older than its watermark.
+    If the watermark is before the last scrape, or too old, is_stop_condition would stop
+    on the next page, which only has reviews we already have: the place is done.
     """
-    assert_data_id_present(request)
-    last_scraped = get_last_scraped(request)
-    # start the review extraction
-    page_number, next_page_token = get_page_num_and_page_token(request)
-    counter = 0
-    while page_number < TOO_MANY_PAGES:
-        logger.info(f'reading {request["name"]} page {page_number}')
-        page_record, next_page_token = process_page(request, page_number, next_page_token)
-        logger.info(f"{page_record['content'][:200]}")
-        reviews = rp.get_page_reviews(page_record, request['language'])
-        if not reviews.empty:
-            logger.info(f"storing page and reviews for {page_number}")
-            store_page(page_record)
-            logger.info(f"stored page {page_number}")
+    if not checkpoint or not checkpoint.get('watermark'):
+        return False
+    watermark = pd.to_datetime(checkpoint['watermark'])
+    return (
+        watermark < last_scraped
+        or datetime.now() - watermark > pd.Timedelta(REVIEWS_TOO_OLD_MONTHS*30, unit='d')
+    )
+
+
+def get_scrape_pipeline() -> str:
+    """
+    sequential: fetch, parse, store, checkpoint, and only then the pause before the next page.
+    pipelined: storage and checkpoint of a page run in a background thread,
+        and the pause before the next page starts as soon as the page is fetched,
+        so the time per page is set by the pacing, not by the datastores.
+    Picked by the `scrape_pipeline` env variable.
+    """
+    pipeline = os.environ.get("scrape_pipeline", DEFAULT_SCRAPE_PIPELINE)
+    if pipeline not in SCRAPE_PIPELINES:
+        raise ValueError(f"Scrape pipeline {pipeline} not supported, use one of {SCRAPE_PIPELINES}")
+    return pipeline
+
+
+def _date_str(moment: Any) -> Optional[str]:
+    return None if pd.isna(moment) else str(pd.to_datetime(moment).date())
+
+
+class PageWriteBuffer:
+    """
+    Write-behind buffer for the pages and reviews of a place.
+    Instead of a Cosmos insert, a Mongo write and a Redis SET per page,
+    pages are flushed together as unordered bulk writes
+    once WRITE_BEHIND_MAX_PAGES are buffered or the oldest one is WRITE_BEHIND_MAX_AGE_S old.
+    The Redis checkpoint moves only after a flush, to the last flushed page:
+    after a crash we resume from what is actually stored, buffered pages are just scraped again.
+    """
+    def __init__(
+        self,
+        request: Dict[str, Any],
+        max_pages: int = WRITE_BEHIND_MAX_PAGES,
+        max_age_s: float = WRITE_BEHIND_MAX_AGE_S
+        ):
+        self.request = request
+        self.max_pages = max_pages
+        self.max_age_s = max_age_s
+        self.page_records: List[Dict[str, Any]] = []
+        self.reviews: List[pd.DataFrame] = []
+        self.last_page_number: Optional[int] = None
+        self._oldest_at: Optional[float] = None
+
+    def add(self, page_record: Dict[str, Any], reviews: pd.DataFrame, page_number: int) -> None:
+        if not self.page_records:
+            self._oldest_at = time.monotonic()
+        self.page_records.append(page_record)
+        self.reviews.append(reviews)
+        self.last_page_number = page_number
+        if self.is_due():
+            self.flush()
+
+    def is_due(self) -> bool:
+        return (
+            len(self.page_records) >= self.max_pages
+            or (self._oldest_at is not None and time.monotonic() - self._oldest_at >= self.max_age_s)
+        )
+
+    def flush(self) -> None:
+        if not self.page_records:
+            return
+        logger.info(f"storing {len(self.page_records)} pages up to {self.last_page_number}")
+        # a review can show up on two pages when new ones push it down between fetches
+        reviews = pd.concat(self.reviews, ignore_index=True).drop_duplicates("unique_review_id")
+        with stage_timer.timed("store"):
+            store_pages(self.page_records)
             store_reviews(reviews)
-            logger.info(f"stored reviews for {page_number}")
-            successful_page_to_redis(request, page_number)
-            if counter > 10:
-                raise ChangeVPNError("change vpn")
-        else:
+        with stage_timer.timed("checkpoint"):
+            checkpoint_to_redis(
+                self.request,
+                self.last_page_number,
+                self.page_records[-1]['next_page_token'],
+                reviews.unique_review_id.tolist(),
+                _date_str(reviews.review_date.min())
+            )
+        logger.info(f"stored pages and reviews up to {self.last_page_number}")
+        self.page_records, self.reviews, self._oldest_at = [], [], None
+
+
+class PlaceScrape:
+    """
+    Review extraction of one place, advanced one page at a time by step().
+    :param storage: if given, the write buffer runs in this executor instead of inline.
+        It has to run one task at a time, so that the checkpoint moves in page order.
+    :param governor: paces the pages, the env configured one if not given
+    """
+    def __init__(
+        self,
+        request: Dict[str, Any],
+        storage: Optional[Executor] = None,
+        governor: Optional[RateGovernor] = None
+        ):
+        assert_data_id_present(request)
+        self.request = request
+        self.governor = governor or RateGovernor.from_env()
+        self.last_scraped = get_last_scraped(request)
+        # start the review extraction
+        checkpoint = get_checkpoint_from_redis(request)
+        self.page_number, self.next_page_token = get_page_num_and_page_token(request, checkpoint)
+        self.counter = 0
+        self.known = get_known_reviews(request)
+        self.done = (
+            self.next_page_token is None
+            or self.page_number >= TOO_MANY_PAGES
+            or is_watermark_past(checkpoint, self.last_scraped)
+        )
+        # time.monotonic() after which the next page can be fetched
+        self.next_fetch_at = 0.0
+        self.buffer = PageWriteBuffer(request)
+        self._storage = storage
+        self._stored: Optional[Future] = None
+
+    def step(self) -> bool:
+        """
+        fetches, parses and stores the next page
+        :returns: whether the place is done
+        """
+        request = self.request
+        logger.info(f'reading {request["name"]} page {self.page_number}')
+        page_record, self.next_page_token = process_page(request, self.page_number, self.next_page_token)
+        fetched_at = time.monotonic()
+        logger.info(f"{page_record['content'][:200]}")
+        with stage_timer.timed("parse"):
+            reviews = rp.get_page_reviews(page_record, request['language'])
+        stage_timer.count("pages")
+        stage_timer.count("reviews", len(reviews))
+        if reviews.empty:
             logger.critical(f"no reviews found for {request['name']}")
             if GOOGLE_ERROR in page_record['content']:
                 raise GoogleKnowsError("google knows")
             else:
-                with open(f"pn{request['name']}_{page_number}.html", 'w') as f:
-                    f.write(page_record['content'])
+                dump_page(page_record)
                 raise NoReviewsError(f"no reviews found for {request['name']}")
 
-        if is_stop_condition(reviews, next_page_token, last_scraped):
+        self.governor.observe()
+        self._write(self.buffer.add, page_record, reviews, self.page_number)
+
+        if is_stop_condition(reviews, self.next_page_token, self.last_scraped):
             logger.info(f"stop condition met for {request['name']}")
-            break
-        
-        page_number += 1
-        counter += 1
-        wait = max(np.random.beta(2, 2) * 2.5 + 2.5, np.random.gamma(5, 2))
-        logger.info(f'sleeping for {wait} s')
-        time.sleep(wait)
-
-    update_places_is_reviewed(request)
-    logger.info(f' [v] finished with {request["name"]}')
+            self.done = True
+            return self.done
+        share = known_share(reviews, self.known)
+        if share >= KNOWN_REVIEWS_STOP_SHARE:
+            logger.info(f"{share:.0%} of page {self.page_number} already stored, done with {request['name']}")
+            self.done = True
+            return self.done
+        if self.counter > PAGES_PER_VPN:
+            raise ChangeVPNError("change vpn")
+
+        self.page_number += 1
+        self.counter += 1
+        self.done = self.page_number >= TOO_MANY_PAGES
+        wait = self.governor.wait()
+        logger.info(f'next page in {wait} s')
+        self.next_fetch_at = (fetched_at if self._storage is not None else time.monotonic()) + wait
+        return self.done
+
+    def flush(self, raise_errors: bool = True) -> None:
+        """
+        stores whatever is buffered, eg. the good pages of a place that failed later on.
+        :param raise_errors: False when another error is already on its way up
+        """
+        try:
+            self._write(self.buffer.flush)
+            self.wait_for_storage()
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.error(f" [!] could not store buffered pages of {self.request['name']}: {e!r}")
+
+    def finish(self) -> None:
+        self.flush()
+        commit_known_reviews(self.request)
+        update_places_is_reviewed(self.request)
+        clear_checkpoint(self.request)
+        logger.info(f' [v] finished with {self.request["name"]}')
+
+    def wait_for_storage(self) -> None:
+        """
+        raises storage errors of the last submitted write
+        """
+        if self._stored is not None:
+            stored, self._stored = self._stored, None
+            stored.result()
+
+    def _write(self, write: Callable, *args) -> None:
+        if self._storage is None:
+            write(*args)
+        else:
+            self.wait_for_storage()
+            self._stored = self._storage.submit(write, *args)
+
+
+def extract_all_reviews(request: Dict[str, Any], governor: Optional[RateGovernor] = None) -> None:
+    """
+    :param request: a dictionary with the following keys:
+        place_id: str,
+        data_id: str
+        country_domain: str
+        language: str,
+        name: str
+        last_scraped: str
+    :param governor: paces the pages, the worker passes one that knows its VPN
+    """
+    pipelined = get_scrape_pipeline() == "pipelined"
+    # on errors, leaving the executor still waits for the writes that were already submitted
+    with (ThreadPoolExecutor(max_workers=1) if pipelined else nullcontext()) as storage:
+        scrape = PlaceScrape(request, storage, governor)
+        try:
+            while not scrape.done:
+                time.sleep(max(0.0, scrape.next_fetch_at - time.monotonic()))
+                scrape.step()
+        except Exception as e:
+            scrape.governor.observe(e)
+            scrape.flush(raise_errors=False)
+            raise
+        scrape.finish()
     
     
 class EmptyPageError(Exception):
@@ -279,3 +701,7 @@ class GoogleKnowsError(Exception):
 
 class ChangeVPNError(Exception):
     pass
+
+# google's 403 / 429 / 503 without a block page: handled like ChangeVPNError, and the rate governor backs off
+class RateLimitedError(ChangeVPNError):
+    pass
@@ -0,0 +1,199 @@
+"""
+rebuilds the reviews collection from raw pages,
+eg. when google changes a css class and the parser had to be fixed.
+Raw pages are streamed in chunks from Cosmos raw_reviews (or a local json lines dump),
+parsed in a process pool with a bounded number of chunks in flight,
+and reviews are written in bulk as chunks come back.
+Stored reviews with the same unique_review_id are replaced, so a rebuild fixes them,
+and the known reviews of the reparsed places are reloaded from mongo on their next scrape.
+Progress is checkpointed to a file, so an interrupted rebuild resumes where it stopped.
+usage:
+    python descobridor/discovery/reparse.py --days 14 --checkpoint reparse.json
+"""
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+from bson import ObjectId
+from more_itertools import chunked
+from pymongo import ReplaceOne
+
+from truby.db_connection import CosmosConnection, MongoConnection
+from descobridor.discovery import review_parser as rp
+from descobridor.discovery.read_raw_reviews import forget_known_reviews
+from descobridor.discovery.constants import (
+    RAW_PAGE_EXPIRATION_S,
+    REPARSE_CHUNK_SIZE,
+    REPARSE_MAX_IN_FLIGHT,
+)
+from descobridor.the_logger import logger
+
+
+RAW_PAGE_FIELDS = (
+    "place_id", "data_id", "name", "scrape_ds", "scrape_language", "page_number",
+    "content", "content_codec", "content_minified"
+)
+# (position, raw page record), position is what the checkpoint stores
+PositionedRecord = Tuple[str, Dict[str, Any]]
+
+
+def iter_raw_pages_from_cosmos(
+    since_ds: str,
+    after: Optional[str] = None,
+    batch_size: int = REPARSE_CHUNK_SIZE
+    ) -> Iterator[PositionedRecord]:
+    """
+    streams raw pages in _id order, so that _id is a valid resume position
+    """
+    query: Dict[str, Any] = {"scrape_ds": {"$gte": since_ds}}
+    if after is not None:
+        query["_id"] = {"$gt": ObjectId(after)}
+    with CosmosConnection("raw_reviews") as conn:
+        cursor = conn.collection.find(query, RAW_PAGE_FIELDS).sort("_id", 1).batch_size(batch_size)
+        for record in cursor:
+            yield str(record.pop("_id")), record
+
+
+def iter_raw_pages_from_dump(
+    path: Path,
+    since_ds: str,
+    after: Optional[str] = None
+    ) -> Iterator[PositionedRecord]:
+    """
+    a dump is a json lines file with one raw page record per line,
+    the line number is the resume position
+    """
+    start = -1 if after is None else int(after)
+    with open(path) as f:
+        for (line_number, line) in enumerate(f):
+            if line_number <= start:
+                continue
+            record = json.loads(line)
+            if record["scrape_ds"] >= since_ds:
+                yield str(line_number), {k: record[k] for k in RAW_PAGE_FIELDS if k in record}
+
+
+def parse_chunk(records: List[Dict[str, Any]]) -> Tuple[pd.DataFrame, int]:
+    """
+    runs in a worker process.
+    A page that doesn't parse anymore is logged and skipped, it shouldn't stop the rebuild.
+    :returns: reviews of all the pages in the chunk, number of failed pages
+    """
+    reviews = []
+    failed = 0
+    for record in records:
+        try:
+            reviews.append(rp.get_page_reviews(record, record["scrape_language"]))
+        except Exception as e:
+            failed += 1
+            logger.warning(f"could not parse {record['place_id']} page {record.get('page_number')}: {e!r}")
+    if not reviews:
+        return pd.DataFrame(), failed
+    return pd.concat(reviews).reset_index(drop=True), failed
+
+
+def store_reviews_bulk(reviews: pd.DataFrame) -> None:
+    """
+    upserts by unique_review_id: reviews that are already stored are rewritten with the new parse.
+    A review scraped several times is in several raw pages, the last one read wins.
+    """
+    if reviews.empty:
+        return
+    reviews = reviews.drop_duplicates("unique_review_id", keep="last")
+    operations = [
+        ReplaceOne({"unique_review_id": review["unique_review_id"]}, review, upsert=True)
+        for review in reviews.to_dict("records")
+    ]
+    with MongoConnection("reviews") as conn:
+        conn.collection.bulk_write(operations, ordered=False)
+    forget_known_reviews(reviews[["place_id", "language"]].drop_duplicates().to_dict("records"))
+
+
+class ReparseCheckpoint:
+    """
+    a json file with the position of the last stored page and running totals.
+    It's replaced atomically, so a crash never leaves a half written checkpoint.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.state = {"position": None, "pages": 0, "reviews": 0, "failed": 0}
+        if self.path.exists():
+            self.state.update(json.loads(self.path.read_text()))
+
+    @property
+    def position(self) -> Optional[str]:
+        return self.state["position"]
+
+    def advance(self, position: str, pages: int, reviews: int, failed: int) -> None:
+        self.state["position"] = position
+        self.state["pages"] += pages
+        self.state["reviews"] += reviews
+        self.state["failed"] += failed
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.state))
+        os.replace(tmp_path, self.path)
+
+
+def reparse(
+    raw_pages: Iterator[PositionedRecord],
+    checkpoint: ReparseCheckpoint,
+    workers: int = 4,
+    chunk_size: int = REPARSE_CHUNK_SIZE,
+    max_in_flight: int = REPARSE_MAX_IN_FLIGHT
+    ) -> Dict[str, Any]:
+    """
+    Chunks are written and checkpointed in the order they were read,
+    so the checkpoint never gets ahead of a chunk that is still being parsed.
+    At most max_in_flight chunks are read but not yet stored.
+    """
+    in_flight: Deque[Tuple[Future, str, int]] = deque()
+
+    def store_oldest() -> None:
+        future, position, n_pages = in_flight.popleft()
+        reviews, failed = future.result()
+        store_reviews_bulk(reviews)
+        checkpoint.advance(position, n_pages, len(reviews), failed)
+        logger.info(f"reparsed up to {position}: {checkpoint.state}")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunked(raw_pages, chunk_size):
+            if len(in_flight) >= max_in_flight:
+                store_oldest()
+            positions, records = zip(*chunk, strict=True)
+            in_flight.append((pool.submit(parse_chunk, list(records)), positions[-1], len(records)))
+        while in_flight:
+            store_oldest()
+    return checkpoint.state
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("--days", type=int, default=RAW_PAGE_EXPIRATION_S // (3600 * 24),
+                      help="reparse pages scraped in the last n days")
+    args.add_argument("--dump", type=Path, help="json lines dump of raw pages instead of Cosmos")
+    args.add_argument("--checkpoint", type=Path, default=Path("reparse_checkpoint.json"))
+    args.add_argument("--restart", action="store_true", help="ignore the existing checkpoint")
+    args.add_argument("--workers", type=int, default=4)
+    args.add_argument("--chunk-size", type=int, default=REPARSE_CHUNK_SIZE)
+    args.add_argument("--max-in-flight", type=int, default=REPARSE_MAX_IN_FLIGHT)
+    arguments = args.parse_args()
+
+    if arguments.restart and arguments.checkpoint.exists():
+        arguments.checkpoint.unlink()
+    checkpoint = ReparseCheckpoint(arguments.checkpoint)
+    since_ds = str(date.today() - timedelta(days=arguments.days))
+    if arguments.dump:
+        raw_pages = iter_raw_pages_from_dump(arguments.dump, since_ds, checkpoint.position)
+    else:
+        raw_pages = iter_raw_pages_from_cosmos(since_ds, checkpoint.position, arguments.chunk_size)
+    state = reparse(raw_pages, checkpoint, arguments.workers, arguments.chunk_size, arguments.max_in_flight)
+    logger.info(f" [v] reparse finished: {state}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Labels a google response before anything parses it, from the status code, headers,
+body length and a byte level scan for the markers of google's block pages.
+A blocked page is a few kB, a review page a few hundred, so the scan is cheap next to a parse.
+"""
+from typing import Mapping, Optional
+
+from descobridor.discovery.constants import (
+    BLOCKED_MARKERS,
+    BLOCKED_URL_MARKER,
+    EMPTY_PAGE_MAX_BYTES,
+    )
+
+
+OK = "ok"
+EMPTY = "empty"
+BLOCKED = "blocked"
+RATE_LIMITED = "rate_limited"
+
+
+def classify_response(
+    status_code: int,
+    headers: Mapping[str, str],
+    body: bytes,
+    url: Optional[str] = None
+    ) -> str:
+    """
+    :param url: final url after redirects, google redirects blocked clients to /sorry/
+    :returns: OK, EMPTY, BLOCKED or RATE_LIMITED.
+        Only the block markers make a response BLOCKED, which stops the worker:
+        a bare 403 / 503 is a throttled or flaky VPN, it's RATE_LIMITED and the VPN is rotated.
+    """
+    if url and BLOCKED_URL_MARKER in url:
+        return BLOCKED
+    if any(marker in body for marker in BLOCKED_MARKERS):
+        return BLOCKED
+    if status_code in (403, 429, 503):
+        return RATE_LIMITED
+    if status_code >= 400:
+        return EMPTY
+    if len(body) <= EMPTY_PAGE_MAX_BYTES:
+        return EMPTY
+    return OK
@@ -1,4 +1,132 @@
+import re
 from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, NamedTuple, Pattern
+import numpy as np
+import pandas as pd
+
+
+# days in a unit of a review age string, eg "hace 2 semanas" is 2 * 7 days.
+# anything younger than a day counts as 0 days.
+AGE_GRAMMAR = {
+    "en": {
+        "pattern": r"^(?P<count>\d+|an?)\s+(?P<unit>\S+)",
+        "counts": {"a": 1, "an": 1},
+        "units": {
+            "second": 0, "seconds": 0, "minute": 0, "minutes": 0, "hour": 0, "hours": 0,
+            "day": 1, "days": 1,
+            "week": 7, "weeks": 7,
+            "month": 30, "months": 30,
+            "year": 365, "years": 365,
+        },
+    },
+    "es": {
+        "pattern": r"^hace\s+(?P<count>\d+|una?)\s+(?P<unit>\S+)",
+        "counts": {"un": 1, "una": 1},
+        "units": {
+            "segundo": 0, "segundos": 0, "secundos": 0,
+            "minuto": 0, "minutos": 0, "minuta": 0, "hora": 0, "horas": 0,
+            "día": 1, "días": 1,
+            "semana": 7, "semanas": 7,
+            "mes": 30, "meses": 30,
+            "año": 365, "años": 365,
+        },
+    },
+}
+
+
+class AgeGrammar(NamedTuple):
+    pattern: Pattern
+    counts: Dict[str, int]
+    units: Dict[str, int]
+
+
+COMPILED_AGE_GRAMMAR = {
+    language: AgeGrammar(re.compile(rules["pattern"]), rules["counts"], rules["units"])
+    for (language, rules) in AGE_GRAMMAR.items()
+}
+
+
+def get_age_grammar(language: str) -> AgeGrammar:
+    try:
+        return COMPILED_AGE_GRAMMAR[language]
+    except KeyError:
+        raise ValueError(f"Language {language} not supported") from None
+
+
+def age_string_to_days(review_age_str: str, language: str) -> int:
+    """
+    Extract the age of the review in days from the string,
+    eg. "a week ago" -> 7, "hace 2 meses" -> 60
+    """
+    grammar = get_age_grammar(language)
+    match = grammar.pattern.match(review_age_str.lower())
+    if match is None:
+        raise ValueError(f"Unknown age format: {review_age_str}")
+    count, unit = match.group("count"), match.group("unit")
+    if unit not in grammar.units:
+        raise ValueError(f"Unknown age unit: {unit}")
+    count = grammar.counts[count] if count in grammar.counts else int(count)
+    return count * grammar.units[unit]
+
+
+# age strings repeat a lot ("a week ago", "hace 2 meses"), scrape dates even more
+AGE_CACHE_SIZE = 4096
+SCRAPE_DS_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=AGE_CACHE_SIZE)
+def cached_age_string_to_days(review_age_str: str, language: str) -> int:
+    return age_string_to_days(review_age_str, language)
+
+
+@lru_cache(maxsize=SCRAPE_DS_CACHE_SIZE)
+def parse_scrape_ds(scrape_ds: str) -> datetime:
+    return datetime.strptime(scrape_ds, '%Y-%m-%d')
+
+
+def precision_from_days(days_before_scrape: np.ndarray) -> np.ndarray:
+    """
+    the older the review, the less precise its date is
+    """
+    return np.select(
+        [days_before_scrape == 0, days_before_scrape < 7, days_before_scrape < 30, days_before_scrape < 365],
+        [0, 1, 7, 30],
+        default=365
+    )
+
+
+def review_age_columns(times: pd.Series, scrape_ds: pd.Series, language: str) -> pd.DataFrame:
+    """
+    Column-wise ReviewAge: computes days_before_scrape, review_date and age_precision
+    for a whole column of review age strings.
+    Age strings and scrape dates repeat a lot, so only their unique values are parsed,
+    and the results are broadcasted back with numpy.
+    A missing time (None or NaN) gets NaN days and precision, and a NaT review_date.
+    """
+    time_codes, unique_times = pd.factorize(times)
+    unique_days = np.array(
+        [cached_age_string_to_days(review_age_str, language) for review_age_str in unique_times],
+        dtype=np.int64
+    )
+    # factorize gives missing values the code -1, which would pick the last unique age
+    missing = time_codes == -1
+    days_before_scrape = np.zeros(len(time_codes), dtype=np.int64)
+    days_before_scrape[~missing] = unique_days[time_codes[~missing]]
+
+    ds_codes, unique_ds = pd.factorize(scrape_ds)
+    unique_scrape_dates = pd.to_datetime(pd.Series(unique_ds), format='%Y-%m-%d').to_numpy()
+    review_date = unique_scrape_dates[ds_codes] - days_before_scrape.astype('timedelta64[D]')
+    age_precision = precision_from_days(days_before_scrape)
+    if missing.any():
+        days_before_scrape = np.where(missing, np.nan, days_before_scrape)
+        review_date[missing] = np.datetime64("NaT")
+        age_precision = np.where(missing, np.nan, age_precision)
+    return pd.DataFrame({
+        "days_before_scrape": days_before_scrape,
+        "review_date": review_date,
+        "age_precision": age_precision,
+    }, index=times.index)
 
 
 class ReviewAge:
@@ -7,17 +135,18 @@ class ReviewAge:
     eg. "Hace 2 semanas" with age in days and with a date of the review.
     It is used in review extration 
     as well as in infrastructure of scraping and re-scraping.
+    Review ages are compared, sorted and hashed by review_date.
     """
+    __slots__ = (
+        "scrape_ds", "string_repr", "language", "scrape_datetime",
+        "days_before_scrape", "review_date", "age_in_days", "precision"
+    )
+
     def __init__(self, scrape_ds: str, string_repr: str, language:str):
         self.scrape_ds = scrape_ds
         self.string_repr = string_repr
         self.language = language
-        self.scrape_datetime = datetime.strptime(scrape_ds, '%Y-%m-%d').replace(
-            hour=0, 
-            minute=0,
-            second=0, 
-            microsecond=0
-            )
+        self.scrape_datetime = parse_scrape_ds(scrape_ds)
         self.days_before_scrape = self.string_to_days(string_repr, language)
         self.review_date = self.scrape_datetime - timedelta(days=self.days_before_scrape)
         self.age_in_days = (datetime.today() - self.review_date).days
@@ -25,27 +154,35 @@ class ReviewAge:
     
     @staticmethod
     def string_to_days(string: str, language: str) -> int:
-        if language == 'es':
-            return ReviewAge.str_es_to_days_before_scrape(string)
-        elif language == "en":
-            return ReviewAge.str_en_to_days_before_scrape(string)
-        else:
-            raise ValueError(f"Language {language} not supported")
+        return cached_age_string_to_days(string, language)
     
-    def __eq__(self, __o: "ReviewAge") -> bool:
-        self.review_date == __o.review_date # noqa B015
+    def __eq__(self, __o: object) -> bool:
+        if not isinstance(__o, ReviewAge):
+            return NotImplemented
+        return self.review_date == __o.review_date
         
     def __lt__(self, __o: "ReviewAge") -> bool:
-        self.review_date < __o.review_date # noqa B015
+        if not isinstance(__o, ReviewAge):
+            return NotImplemented
+        return self.review_date < __o.review_date
         
     def __gt__(self, __o: "ReviewAge") -> bool:
-        self.review_date > __o.review_date # noqa B015
+        if not isinstance(__o, ReviewAge):
+            return NotImplemented
+        return self.review_date > __o.review_date
         
     def __le__(self, __o: "ReviewAge") -> bool:
-        self.review_date <= __o.review_date # noqa B015
+        if not isinstance(__o, ReviewAge):
+            return NotImplemented
+        return self.review_date <= __o.review_date
         
     def __ge__(self, __o: "ReviewAge") -> bool:
-        self.review_date >= __o.review_date # noqa B015
+        if not isinstance(__o, ReviewAge):
+            return NotImplemented
+        return self.review_date >= __o.review_date
+
+    def __hash__(self) -> int:
+        return hash(self.review_date)
         
     def __str__(self) -> str:
         return self.review_date.strftime('%Y-%m-%d')
@@ -73,52 +210,11 @@ class ReviewAge:
         """
         Extract the age of the review in days from the string
         """
-        age_list = review_age_str.lower().split(' ')
-        assert age_list[0] == 'hace'
-        if age_list[2] in ('minutos', 'minuta', 'secundos', 'hora', 'horas'):
-            return 0
-        elif age_list[2] in ('día', 'días'):
-            if age_list[1] == 'un':
-                return 1
-            return int(age_list[1])
-        elif age_list[2] in ('semana', 'semanas'):
-            if age_list[1] == 'una':
-                return 1
-            return int(age_list[1]) * 7
-        elif age_list[2] in ('mes', 'meses'):
-            if age_list[1] == 'un':
-                return 30
-            return int(age_list[1]) * 30
-        elif age_list[2] in ('año', 'años'):
-            if age_list[1] == 'un':
-                return 365
-            return int(age_list[1]) * 365
-        else:
-            raise ValueError(f"Unknown age unit: {age_list[2]}")
+        return age_string_to_days(review_age_str, "es")
 
     @staticmethod
     def str_en_to_days_before_scrape(review_age_str: str) -> int:
         """
         Extract the age of the review in days from the string
         """
-        age_list = review_age_str.lower().split(' ')
-        if age_list[1] in ('minute', 'minutes', 'second', 'seconds', 'hour', 'hours'):
-            return 0
-        elif age_list[1] in ('day', 'days'):
-            if age_list[0] == 'a':
-                return 1
-            return int(age_list[0])
-        elif age_list[1] in ('week', 'weeks'):
-            if age_list[0] == 'a':
-                return 1
-            return int(age_list[0]) * 7
-        elif age_list[1] in ('month', 'months'):
-            if age_list[0] == 'a':
-                return 30
-            return int(age_list[0]) * 30
-        elif age_list[1] in ('year', 'years'):
-            if age_list[0] == 'a':
-                return 365
-            return int(age_list[0]) * 365
-        else:
-            raise ValueError(f"Unknown age unit: {age_list[1]}")
+        return age_string_to_days(review_age_str, "en")
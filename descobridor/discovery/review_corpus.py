@@ -0,0 +1,230 @@
+"""
+A corpus of saved review pages with their expected parsed output,
+used to catch parser breakage and speed regressions before deploying to the workers.
+
+corpus layout:
+    <corpus>/<language>/<case>.html            page content
+    <corpus>/<language>/<case>.json            the rest of the page record
+    <corpus>/<language>/<case>.expected.json   expected get_page_reviews output, one record per review
+
+usage:
+    # turn pages dumped by extract_all_reviews into cases (expected output has to be reviewed by hand)
+    python descobridor/discovery/review_corpus.py add --language es pnSomePlace_3.html
+    # parser regression check
+    python descobridor/discovery/review_corpus.py check
+    # pages/s and reviews/s per stage
+    python descobridor/discovery/review_corpus.py bench --output bench.json
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import pandas as pd
+
+from descobridor.discovery import review_parser as rp
+from descobridor.discovery.page_codec import page_content
+
+
+DEFAULT_CORPUS_DIR = Path("corpus")
+PAGE_RECORD_FIELDS = ("place_id", "data_id", "name", "scrape_ds", "scrape_language", "page_number")
+
+
+class CorpusCase(NamedTuple):
+    name: str
+    language: str
+    page_record: Dict[str, Any]
+    expected: List[Dict[str, Any]]
+
+
+def reviews_to_records(reviews: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    the json form of get_page_reviews output, used both to store and to compare
+    """
+    return json.loads(reviews.to_json(orient="records", date_format="iso", force_ascii=False))
+
+
+def save_case(
+    corpus_dir: Path,
+    case_name: str,
+    page_record: Dict[str, Any],
+    language: str,
+    expected: Optional[pd.DataFrame] = None
+    ) -> Path:
+    """
+    stores a page as a corpus case.
+    If the expected output is not given, the current parser output is stored,
+    it has to be reviewed before it's trusted.
+    """
+    case_dir = Path(corpus_dir) / language
+    case_dir.mkdir(parents=True, exist_ok=True)
+    if expected is None:
+        expected = rp.get_page_reviews(page_record, language)
+    (case_dir / f"{case_name}.html").write_text(page_content(page_record))
+    (case_dir / f"{case_name}.json").write_text(json.dumps(
+        {k: page_record.get(k) for k in PAGE_RECORD_FIELDS}, indent=2, ensure_ascii=False))
+    (case_dir / f"{case_name}.expected.json").write_text(json.dumps(
+        reviews_to_records(expected), indent=2, ensure_ascii=False))
+    return case_dir / f"{case_name}.html"
+
+
+def load_case(html_path: Path) -> CorpusCase:
+    case_name = html_path.stem
+    language = html_path.parent.name
+    page_record = json.loads(html_path.with_suffix(".json").read_text())
+    page_record["content"] = html_path.read_text()
+    expected = json.loads((html_path.parent / f"{case_name}.expected.json").read_text())
+    return CorpusCase(case_name, language, page_record, expected)
+
+
+def load_corpus(corpus_dir: Path, languages: Optional[List[str]] = None) -> List[CorpusCase]:
+    return [
+        load_case(html_path)
+        for html_path in sorted(Path(corpus_dir).glob("*/*.html"))
+        if languages is None or html_path.parent.name in languages
+    ]
+
+
+def dumped_page_to_record(html_path: Path, language: str) -> Dict[str, Any]:
+    """
+    extract_all_reviews dumps pages without reviews as pn{name}_{page}.html,
+    with the page record next to it as pn{name}_{page}.json.
+    Older dumps don't have the record, it's filled with placeholders then.
+    """
+    record_path = html_path.with_suffix(".json")
+    if record_path.exists():
+        page_record = json.loads(record_path.read_text())
+    else:
+        page_record = {
+            'place_id': html_path.stem,
+            'data_id': html_path.stem,
+            'name': html_path.stem,
+            'scrape_ds': str(date.today()),
+            'scrape_language': language,
+            'page_number': None,
+        }
+    page_record["content"] = html_path.read_text()
+    return page_record
+
+
+def check_case(case: CorpusCase) -> List[str]:
+    """
+    :returns: human readable differences between the parser output and the expected one
+    """
+    actual = reviews_to_records(rp.get_page_reviews(case.page_record, case.language))
+    problems = []
+    if len(actual) != len(case.expected):
+        problems.append(f"expected {len(case.expected)} reviews, got {len(actual)}")
+    # on a count mismatch the common reviews are still compared, to show where they start to differ
+    for (i, (actual_review, expected_review)) in enumerate(zip(actual, case.expected, strict=False)):
+        for key in expected_review.keys() | actual_review.keys():
+            if actual_review.get(key) != expected_review.get(key):
+                problems.append(
+                    f"review {i} {key}: "
+                    f"expected {expected_review.get(key)!r}, got {actual_review.get(key)!r}")
+    return problems
+
+
+def check_corpus(cases: List[CorpusCase]) -> int:
+    """
+    prints the problems of the cases that fail
+    :returns: how many of them fail
+    """
+    failed = 0
+    for case in cases:
+        problems = check_case(case)
+        if problems:
+            failed += 1
+            print(f"[!] {case.language}/{case.name}")
+            for problem in problems:
+                print(f"    {problem}")
+    return failed
+
+
+def _time_stage(func: Callable, inputs: List[Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    outputs = [func(x) for x in inputs]
+    return {"seconds": time.perf_counter() - start, "outputs": outputs}
+
+
+def benchmark(cases: List[CorpusCase], repeat: int = 3) -> Dict[str, Any]:
+    """
+    times the parsing stages separately, and get_page_reviews as a whole.
+    Best of `repeat` runs is reported.
+    """
+    stages = {}
+    for _ in range(repeat):
+        runs = {}
+        runs["parse_the_page"] = _time_stage(
+            lambda case: (rp.parse_the_page(case.page_record, case.language), case.language), cases)
+        parsed = [(df, language) for (df, language) in runs["parse_the_page"]["outputs"] if not df.empty]
+        runs["add_review_age"] = _time_stage(lambda x: rp.add_review_age(*x), parsed)
+        runs["add_unique_review_id"] = _time_stage(rp.add_unique_review_id, runs["add_review_age"]["outputs"])
+        runs["get_page_reviews"] = _time_stage(
+            lambda case: rp.get_page_reviews(case.page_record, case.language), cases)
+        for (stage, run) in runs.items():
+            if stage not in stages or run["seconds"] < stages[stage]:
+                stages[stage] = run["seconds"]
+
+    n_pages = len(cases)
+    n_reviews = sum(len(df) for df in runs["get_page_reviews"]["outputs"])
+    return {
+        "created_at": datetime.now().isoformat(),
+        "html_parser": rp.get_parser_backend(),
+        "extraction_mode": rp.get_extraction_mode(),
+        "pages": n_pages,
+        "reviews": n_reviews,
+        "stages": {
+            stage: {
+                "seconds": seconds,
+                "pages_per_s": n_pages / seconds if seconds else None,
+                "reviews_per_s": n_reviews / seconds if seconds else None,
+            }
+            for (stage, seconds) in stages.items()
+        },
+    }
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS_DIR)
+    args.add_argument("--languages", nargs="+")
+    commands = args.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="turn dumped pages into corpus cases")
+    add.add_argument("pages", nargs="+", type=Path)
+    add.add_argument("--language", required=True)
+    commands.add_parser("check", help="compare parser output with the expected one")
+    bench = commands.add_parser("bench", help="pages/s and reviews/s of the parsing stages")
+    bench.add_argument("--repeat", type=int, default=3)
+    bench.add_argument("--output", type=Path, help="where to write the json results")
+    arguments = args.parse_args()
+
+    if arguments.command == "add":
+        for html_path in arguments.pages:
+            page_record = dumped_page_to_record(html_path, arguments.language)
+            saved = save_case(arguments.corpus, html_path.stem, page_record, arguments.language)
+            print(f"added {saved}, review its expected output")
+
+    elif arguments.command == "check":
+        cases = load_corpus(arguments.corpus, arguments.languages)
+        if not cases:
+            # a wrong --corpus path or language must not pass as a green check
+            print(f"[!] no cases in {arguments.corpus}")
+            sys.exit(1)
+        failed = check_corpus(cases)
+        print(f"{len(cases) - failed}/{len(cases)} cases pass")
+        sys.exit(1 if failed else 0)
+
+    elif arguments.command == "bench":
+        results = benchmark(load_corpus(arguments.corpus, arguments.languages), arguments.repeat)
+        for (stage, result) in results["stages"].items():
+            print(f"{stage:>22}: {result['pages_per_s']:.1f} pages/s, "
+                  f"{result['reviews_per_s']:.1f} reviews/s")
+        if arguments.output:
+            arguments.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
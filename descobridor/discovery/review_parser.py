@@ -1,21 +1,61 @@
-from typing import List, Dict, Any
-from bs4 import BeautifulSoup
+from typing import List, Dict, Any, Optional, Tuple
+from bs4 import BeautifulSoup, Tag
+import os
 import re
+import importlib.util
+from functools import lru_cache
 import pandas as pd
 import hashlib
 from joblib import Parallel, delayed
 from dotenv import load_dotenv
 
 from descobridor.helpers import get_localized_parser
-from descobridor.discovery.review_age import ReviewAge
+from descobridor.discovery.constants import (
+    DEFAULT_HTML_PARSER,
+    HTML_PARSER_BACKENDS,
+    DEFAULT_EXTRACTION_MODE,
+    EXTRACTION_MODES,
+    NAME_CLASS,
+    TIME_CLASS,
+)
+from descobridor.discovery.review_age import review_age_columns
+from descobridor.discovery.page_codec import page_content
 from descobridor.the_logger import logger
 
 
 load_dotenv()
 
+STARS_PATTERN = re.compile(r"\d{1}")
 
-def get_soup(row):
-    soup = BeautifulSoup(row, "html.parser")
+@lru_cache(maxsize=None)
+def _is_backend_installed(backend: str) -> bool:
+    """
+    cached, so the fallback warning is logged once per backend, not once per page
+    """
+    if backend == DEFAULT_HTML_PARSER:
+        return True
+    if importlib.util.find_spec(backend) is None:
+        logger.warning(f"{backend} is not installed, falling back to {DEFAULT_HTML_PARSER}")
+        return False
+    return True
+
+
+def get_parser_backend(backend: Optional[str] = None) -> str:
+    """
+    which html parser BeautifulSoup should use.
+    If not given explicitly, it's picked from the `html_parser` env variable.
+    lxml is an optional dependency: if it's not installed, we fall back to html.parser
+    """
+    backend = backend or os.environ.get("html_parser", DEFAULT_HTML_PARSER)
+    if backend not in HTML_PARSER_BACKENDS:
+        raise ValueError(f"Html parser {backend} not supported, use one of {HTML_PARSER_BACKENDS}")
+    if not _is_backend_installed(backend):
+        return DEFAULT_HTML_PARSER
+    return backend
+
+
+def get_soup(row, backend: Optional[str] = None):
+    soup = BeautifulSoup(row, get_parser_backend(backend))
     return soup
 
 
@@ -93,7 +133,10 @@ def get_full_review(text, original_tag, translated_tag, full_review_class, sing_
     if not full_review:
         review_container = text.findChild("span", class_=sing_lang_review_class)
         if review_container:
-            review_group = list(review_container.children)[1]
+            # first tag child: prettified pages have whitespace before it, raw pages don't
+            review_group = review_container.find(recursive=False)
+            if review_group is None or not review_group.contents:
+                return "", ""
             original = review_group.contents[0].strip()
             return original, original
         else:
@@ -123,26 +166,37 @@ def soup_to_reviews(soup: BeautifulSoup, language) -> List[List[str]]:
     return reviews_df
 
 
+def _clean_name(name) -> str:
+    return " ".join(name.text.split("\n")).replace(",", "").replace("|", "").strip()
+
+
+def _clean_time(text) -> Optional[str]:
+    """
+    None if the time node has no text, add_review_age gives it no date
+    """
+    line = " ".join(text.text.split("\n")).split()
+    return " ".join(line).strip() or None
+
+
+def _stars_to_float(text) -> float:
+    line = STARS_PATTERN.findall(str(text))[0].strip()
+    return float(line)
+
+
 #get lis with users name
 def get_name_list(soup: BeautifulSoup) -> pd.Series:    
     """
     user name is in div with class TSUbDb
     """
-    names_text = soup.find_all("div", class_="TSUbDb")
-    list_of_texts = []        
-    for name in names_text:              
-        list_of_texts.append(" ".join(name.text.split("\n")).replace(",", "").replace("|", "").strip())   
+    names_text = soup.find_all("div", class_=NAME_CLASS)
+    list_of_texts = [_clean_name(name) for name in names_text]
     return pd.Series(list_of_texts, name="reviewer_name")
 
 
 #get time of review and add to list 
 def get_times(soup: BeautifulSoup) -> pd.Series:
-    texts = soup.find_all("div", class_="PuaHbe")
-    list_of_texts = []        
-    for text in texts:         
-        line = " ".join(text.text.split("\n")).split()
-        clean_line = (" ".join(line).strip())
-        list_of_texts.append(clean_line)   
+    texts = soup.find_all("div", class_=TIME_CLASS)
+    list_of_texts = [_clean_time(text) for text in texts]
     return pd.Series(list_of_texts, name="time")
 
 
@@ -152,15 +206,104 @@ def get_stars(soup: BeautifulSoup, stars_class) -> List[int]:
     returns stars given in a review
     """
     texts = soup.find_all("span", class_=stars_class)
-    list_of_ratings = [None for _ in range(len(texts))]     
-    for (i, text) in enumerate(texts):      
-        str_line = str(text)
-        pattern = re.compile(r"\d{1}")
-        line=pattern.findall(str_line)[0].strip()
-        list_of_ratings[i] = float(line)
+    list_of_ratings = [_stars_to_float(text) for text in texts]
     return pd.Series(list_of_ratings, name="stars")             
 
 
+def _has_class(tag: Tag, css_class: str) -> bool:
+    """
+    same matching as BeautifulSoup's class_:
+    a class with spaces has to match the whole class attribute
+    """
+    classes = tag.get("class")
+    if not classes:
+        return False
+    if " " in css_class:
+        return " ".join(classes) == css_class
+    return css_class in classes
+
+
+def block_fields(block: Tag, fields: Dict[str, Tuple[str, str]]) -> Dict[str, Tag]:
+    """
+    walks the review container once, picking the first tag for each field
+    :param fields: {field: (tag name, class)}
+    """
+    found = {}
+    for tag in block.descendants:
+        if not isinstance(tag, Tag):
+            continue
+        for field, (tag_name, css_class) in fields.items():
+            if field not in found and tag.name == tag_name and _has_class(tag, css_class):
+                found[field] = tag
+        if len(found) == len(fields):
+            break
+    return found
+
+
+def block_to_review(
+    found: Dict[str, Tag],
+    loc_parser: Dict[str, str]
+    ) -> Tuple[str, str, str, Optional[str], Optional[float]]:
+    """
+    a missing field stays empty instead of shifting the other reviews.
+    """
+    review_original, review_target_language = get_full_review(
+        found["text"],
+        loc_parser["original_tag"],
+        loc_parser["translated_tag"],
+        loc_parser["full_review_class"],
+        loc_parser["sing_lang_review_class"]
+    )
+    return (
+        review_original,
+        review_target_language,
+        _clean_name(found["name"]) if "name" in found else "",
+        _clean_time(found["time"]) if "time" in found else None,
+        _stars_to_float(found["stars"]) if "stars" in found else None,
+    )
+
+
+def soup_to_review_blocks(soup: BeautifulSoup, language: str) -> pd.DataFrame:
+    """
+    single pass alternative to soup_to_reviews + get_name_list + get_times + get_stars:
+    each review container is found once, and all the fields are taken from inside it.
+    """
+    loc_parser = get_localized_parser(language)
+    fields = {
+        "text": ("div", loc_parser["review_class"]),
+        "name": ("div", NAME_CLASS),
+        "time": ("div", TIME_CLASS),
+        "stars": ("span", loc_parser["stars_class"]),
+    }
+    blocks = soup.find_all("div", class_=loc_parser["review_block_class"])
+    logger.debug(f"Found {len(blocks)} review blocks")
+    reviews = []
+    for block in blocks:
+        found = block_fields(block, fields)
+        # a container without review text is not a review
+        if "text" in found:
+            reviews.append(block_to_review(found, loc_parser))
+    reviews_df = pd.DataFrame(
+        reviews,
+        columns=["review_original", "review_target_language", "reviewer_name", "time", "stars"]
+    )
+    reviews_df.insert(2, "language", language)
+    reviews_df["stars"] = reviews_df["stars"].astype(float)
+    return reviews_df
+
+
+def get_extraction_mode(mode: Optional[str] = None) -> str:
+    """
+    global mode runs a find_all per field over the whole page and zips them,
+    per_block mode goes through review containers once.
+    If not given explicitly, it's picked from the `review_extraction` env variable.
+    """
+    mode = mode or os.environ.get("review_extraction", DEFAULT_EXTRACTION_MODE)
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Extraction mode {mode} not supported, use one of {EXTRACTION_MODES}")
+    return mode
+
+
 def add_food_service_atmosphere(review: Dict[str, Any], loc: Dict[str, str]):
     review = review.copy()
     if loc["food"] not in review:
@@ -182,24 +325,31 @@ def filter_review_keys(review: Dict[str, Any]) -> Dict[str, Any]:
 
 
 #get all reviews to a final dict
-def parse_the_page(page_record: Dict[str, Any], language: str) -> pd.DataFrame:
+def parse_the_page(
+    page_record: Dict[str, Any],
+    language: str,
+    backend: Optional[str] = None,
+    mode: Optional[str] = None
+    ) -> pd.DataFrame:
     loc_parser = get_localized_parser(language)
-    content = page_record["content"]
-    soup = get_soup(content)  
-    reviews = soup_to_reviews(soup, language)
-    names = get_name_list(soup)
-    time = get_times(soup)
-    stars= get_stars(soup, loc_parser["stars_class"])
+    content = page_content(page_record)
+    soup = get_soup(content, backend)
+    if get_extraction_mode(mode) == "per_block":
+        reviews = soup_to_review_blocks(soup, language)
+        fields = [reviews]
+    else:
+        reviews = soup_to_reviews(soup, language)
+        names = get_name_list(soup)
+        time = get_times(soup)
+        stars= get_stars(soup, loc_parser["stars_class"])
+        fields = [reviews, names, time, stars]
     
     restaurant_name = pd.Series([page_record["name"]] * len(reviews),  name="restaurant_name")
     scrape_ds = pd.Series([page_record["scrape_ds"]] * len(reviews), name="scrape_ds")
     place_ids = pd.Series([page_record["place_id"]] * len(reviews), name="place_id")
     data_ids = pd.Series([page_record["data_id"]] * len(reviews), name="data_id")
     return pd.concat([
-        reviews,
-        names,
-        time, 
-        stars,
+        *fields,
         restaurant_name,
         scrape_ds,
         place_ids,
@@ -209,11 +359,10 @@ def parse_the_page(page_record: Dict[str, Any], language: str) -> pd.DataFrame:
 
 def add_review_age(review_df: pd.DataFrame, language: str) -> pd.DataFrame:
     review_df = review_df.copy()
-    review_df["review_age"] = review_df.apply(
-        lambda df: ReviewAge(df["scrape_ds"], df["time"], language), axis=1)
-    review_df['age_precision'] = review_df['review_age'].apply(lambda x: x.precision)
-    review_df['review_date'] = review_df['review_age'].apply(lambda x: x.review_date)
-    return review_df.drop(columns=["review_age"])
+    ages = review_age_columns(review_df["time"], review_df["scrape_ds"], language)
+    review_df['age_precision'] = ages['age_precision']
+    review_df['review_date'] = ages['review_date']
+    return review_df
 
 
 def add_unique_review_id(review_df: pd.DataFrame) -> pd.DataFrame:
@@ -224,14 +373,30 @@ def add_unique_review_id(review_df: pd.DataFrame) -> pd.DataFrame:
     return review_df
 
 
-def get_page_reviews(page_record: Dict[str, Any], language: str) -> pd.DataFrame:
-    review_df = parse_the_page(page_record, language)
+def get_page_reviews(
+    page_record: Dict[str, Any],
+    language: str,
+    backend: Optional[str] = None,
+    mode: Optional[str] = None
+    ) -> pd.DataFrame:
+    """
+    :param backend: html parser to use, see get_parser_backend.
+        The output doesn't depend on it, only the speed does.
+    :param mode: review extraction mode, see get_extraction_mode.
+    """
+    review_df = parse_the_page(page_record, language, backend, mode)
     if review_df.empty:
         return review_df
-    else:
-        review_df = add_review_age(review_df, language)
-        review_df = add_unique_review_id(review_df)
-        return review_df
+    review_df = add_review_age(review_df, language)
+    # a review without a time can't be dated, one such block shouldn't fail the whole page
+    undated = review_df["review_date"].isna()
+    if undated.any():
+        logger.warning(f"dropping {undated.sum()} reviews without a time of {page_record['name']}")
+        review_df = review_df[~undated].reset_index(drop=True)
+        if review_df.empty:
+            return review_df
+    review_df = add_unique_review_id(review_df)
+    return review_df
 
 
 #scrape all reviews from a given df
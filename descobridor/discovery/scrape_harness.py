@@ -0,0 +1,125 @@
+"""
+End to end throughput of the scrape loop, against fake_google.py instead of google.
+Places go through extract_all_reviews with the configured pipeline, storage and checkpoints,
+so the datastores in .env are written to: point it at test databases.
+Pacing is the configured one, compressed by --pace-factor.
+
+usage:
+    python descobridor/discovery/scrape_harness.py --corpus corpus --places 5 --pages 20 \\
+        --latency 0.2 --pace-factor 0.01 --output harness.json
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from descobridor.discovery.fake_google import FakeGoogle, FakeGoogleConfig, load_fixture_pages
+from descobridor.discovery.rate_governor import PacingPolicy, RateGovernor
+from descobridor.discovery.read_raw_reviews import extract_all_reviews
+from descobridor.discovery.review_corpus import DEFAULT_CORPUS_DIR
+from descobridor.discovery.stage_timer import stage_timer
+from descobridor.the_logger import logger
+
+
+class CompressedPacing(RateGovernor):
+    def __init__(self, pace_factor: float, policy: Optional[PacingPolicy] = None):
+        super().__init__(worker=f"harness_{uuid.uuid4().hex[:8]}", policy=policy)
+        self.pace_factor = pace_factor
+
+    def wait(self) -> float:
+        return super().wait() * self.pace_factor
+
+
+def make_requests(n_places: int, language: str) -> List[Dict[str, Any]]:
+    """
+    new place ids every run, so that checkpoints and known reviews of earlier runs don't interfere
+    """
+    run_id = uuid.uuid4().hex[:8]
+    return [
+        {
+            "place_id": f"harness_{run_id}_{i}",
+            "data_id": f"0x0:0x{run_id}{i}",
+            "name": f"harness place {i}",
+            "language": language,
+            "country_domain": "com",
+            "priority": 1,
+            "last_scraped": "2015-01-01",
+        }
+        for i in range(n_places)
+    ]
+
+
+def run_harness(
+    fake_google: FakeGoogle,
+    requests: List[Dict[str, Any]],
+    pace_factor: float
+    ) -> Dict[str, Any]:
+    server = fake_google.serve_in_background()
+    os.environ["google_base_url"] = f"http://127.0.0.1:{server.server_address[1]}"
+    stage_timer.reset()
+    outcomes: Dict[str, int] = {}
+    start = time.perf_counter()
+    try:
+        for request in requests:
+            try:
+                extract_all_reviews(request, CompressedPacing(pace_factor, RateGovernor.from_env().policy))
+                outcome = "done"
+            except Exception as e:
+                logger.warning(f" [!] {request['name']} failed: {e!r}")
+                outcome = type(e).__name__
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    finally:
+        server.shutdown()
+    wall_s = time.perf_counter() - start
+
+    timings = stage_timer.snapshot()
+    counts = timings["counts"]
+    return {
+        "created_at": datetime.now().isoformat(),
+        "places": len(requests),
+        "outcomes": outcomes,
+        "served": dict(fake_google.served),
+        "wall_s": wall_s,
+        "pages": counts.get("pages", 0),
+        "reviews": counts.get("reviews", 0),
+        "pages_per_s": counts.get("pages", 0) / wall_s,
+        "reviews_per_s": counts.get("reviews", 0) / wall_s,
+        "stages": timings["stages"],
+    }
+
+
+def main() -> None:
+    args = argparse.ArgumentParser()
+    args.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS_DIR)
+    args.add_argument("--language", default="en")
+    args.add_argument("--places", type=int, default=5)
+    args.add_argument("--pages", type=int, default=20, help="pages per place")
+    args.add_argument("--latency", type=float, default=0.0)
+    args.add_argument("--empty-rate", type=float, default=0.0)
+    args.add_argument("--block-rate", type=float, default=0.0)
+    args.add_argument("--pace-factor", type=float, default=0.01)
+    args.add_argument("--seed", type=int)
+    args.add_argument("--output", type=Path, help="where to write the json results")
+    arguments = args.parse_args()
+
+    config = FakeGoogleConfig(
+        arguments.pages, arguments.latency, arguments.empty_rate, arguments.block_rate, arguments.seed)
+    fake_google = FakeGoogle(load_fixture_pages(arguments.corpus), config)
+    results = run_harness(
+        fake_google, make_requests(arguments.places, arguments.language), arguments.pace_factor)
+
+    print(f"{results['pages']} pages, {results['reviews']} reviews in {results['wall_s']:.1f} s: "
+          f"{results['pages_per_s']:.2f} pages/s, {results['reviews_per_s']:.1f} reviews/s")
+    print(f"outcomes: {results['outcomes']}, served: {results['served']}")
+    for (stage, timing) in results["stages"].items():
+        print(f"{stage:>11}: {timing['seconds']:.2f} s in {timing['calls']} calls")
+    if arguments.output:
+        arguments.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
+from concurrent.futures import Executor
 from datetime import date, datetime
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from serpapi import GoogleSearch
 import os
 import pandas as pd
@@ -37,13 +38,16 @@ def serp_search_place(
     place_id: str, 
     place_name: str, 
     place_coord: Tuple[float, float],
-    use_cache: Optional[bool] = True
+    use_cache: Optional[bool] = True,
+    link_pool: Optional[Executor] = None
     ) -> Dict[str, Any]:
     """
     searches for data_id of a given place
     data_id can be easily found in SERP API.
     SERP API is expensive and returns supruss of results.
     So we cache them and do not requery ever.
+    :param link_pool: links the entries back to places concurrently,
+        otherwise one after the other. Either way they're all linked when this returns.
     """
     if use_cache:
         cached_output = read_serp_cache(place_id)
@@ -56,19 +60,31 @@ def serp_search_place(
             
     if not use_cache or not cached_output:
         serp_output = serp_search_no_cache(place_name, place_coord)
-        for entry in serp_output['place_results']:
-            entry = format_serp_entry(entry)
-            print(f"linking back {entry['title']}")
-            link_back_to_place_id(entry)
+        link_all_back(serp_output['place_results'], link_pool)
         try:
             cache_serp_output(serp_output)
         except: # noqa E722
             print(f"could not save {place_name=}")
             
-    if is_unserpable:
+    if is_unserpable(place_id):
         mark_as_unserpable(place_id)
 
 
+def link_all_back(entries: List[Dict[str, Any]], link_pool: Optional[Executor] = None) -> None:
+    """
+    every entry is a find_place and a place call to google, and a mongo update,
+    they don't depend on each other
+    """
+    entries = [format_serp_entry(entry) for entry in entries]
+    if link_pool is None:
+        for entry in entries:
+            print(f"linking back {entry['title']}")
+            link_back_to_place_id(entry)
+    else:
+        print(f"linking back {len(entries)} places")
+        # list() waits for all of them, and raises the first error like the loop would
+        list(link_pool.map(link_back_to_place_id, entries))
+
 
 def link_back_to_place_id(serp_entry: Dict[str, Any]) -> None:
     """
@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+class StageTimer:
+    """
+    Process-wide time spent in each stage of the scrape (fetch, parse, store, checkpoint)
+    and counters (pages, reviews). Stages can run in the storage thread, hence the lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._seconds: Dict[str, float] = defaultdict(float)
+            self._calls: Dict[str, int] = defaultdict(int)
+            self._counts: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._seconds[stage] += elapsed
+                self._calls[stage] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counts[name] += n
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {"seconds": seconds, "calls": self._calls[stage]}
+                    for (stage, seconds) in self._seconds.items()
+                },
+                "counts": dict(self._counts),
+            }
+
+
+stage_timer = StageTimer()
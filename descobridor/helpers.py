@@ -1,21 +1,132 @@
+import os
+import threading
+import time
 import yaml
-from typing import Dict
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
 
 
-def get_localization(country) -> Dict[str, str]:
+LOCALIZATION_PATH = Path(__file__).resolve().parents[1] / "localization.yaml"
+# how often we look at the file's mtime, so that the hot path doesn't hit the disk
+LOCALIZATION_CHECK_INTERVAL_S = 5
+
+COUNTRY_KEYS = {"language", "domain"}
+COUNTRY_LANGUAGE_KEYS = {"language", "food", "service", "athmosphere"}
+PARSER_KEYS = {
+    "stars_class",
+    "review_block_class",
+    "review_class",
+    "sing_lang_review_class",
+    "full_review_class",
+    "translated_tag",
+    "original_tag",
+}
+
+
+class LocalizationRegistry:
+    """
+    Process-wide view of localization.yaml.
+    The file is loaded and validated once, and per country / per language settings
+    are kept as read-only mappings that are shared by all callers.
+    There's nothing to precompile: the parser settings are class names and tags,
+    the date grammars live in review_age.py and are compiled when it's imported.
+    It's reloaded only when the file's mtime changes.
+    """
+    def __init__(
+        self,
+        path: Path = LOCALIZATION_PATH,
+        check_interval_s: float = LOCALIZATION_CHECK_INTERVAL_S
+        ):
+        self.path = Path(path)
+        self.check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self._checked_at = float("-inf")
+        self._countries: Dict[str, Mapping[str, str]] = {}
+        self._parsers: Dict[str, Mapping[str, str]] = {}
+
+    def localization(self, country: str) -> Mapping[str, str]:
+        self._refresh()
+        try:
+            return self._countries[country]
+        except KeyError:
+            raise LocalizationError(f"Country {country} is not in {self.path}") from None
+
+    def parser(self, language: str) -> Mapping[str, str]:
+        self._refresh()
+        try:
+            return self._parsers[language]
+        except KeyError:
+            raise LocalizationError(f"No review parser for language {language} in {self.path}") from None
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval_s:
+            return
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                with open(self.path) as f:
+                    loc_config = yaml.safe_load(f)
+                self._countries, self._parsers = self.compile(loc_config)
+                self._mtime = mtime
+            self._checked_at = now
+
+    @staticmethod
+    def compile(loc_config: Dict[str, Any]):
+        """
+        validates the config and turns it into
+        {country: localization} and {language: parser settings}
+        """
+        parsers = {}
+        for (language, settings) in loc_config.get("review_parser", {}).items():
+            _assert_keys(settings, PARSER_KEYS, f"review_parser.{language}")
+            parsers[language] = MappingProxyType(
+                {key: str(value) for key, value in settings.items()}
+            )
+
+        countries = {}
+        for (country, settings) in loc_config.items():
+            if country == "review_parser":
+                continue
+            _assert_keys(settings, COUNTRY_KEYS, country)
+            _assert_keys(settings["language"], COUNTRY_LANGUAGE_KEYS, f"{country}.language")
+            if settings["language"]["language"] not in parsers:
+                raise LocalizationError(
+                    f"{country} uses language {settings['language']['language']} without a review parser")
+            countries[country] = MappingProxyType({
+                'country': country,
+                'language': settings["language"]["language"],
+                'domain': settings["domain"],
+                'food': settings["language"]["food"],
+                'service': settings["language"]["service"],
+                'athmosphere': settings["language"]["athmosphere"]
+            })
+        return countries, parsers
+
+
+def _assert_keys(settings: Any, required: set, section: str) -> None:
+    if not isinstance(settings, dict):
+        raise LocalizationError(f"{section} should be a mapping, got {settings!r}")
+    missing = required - set(settings)
+    if missing:
+        raise LocalizationError(f"{section} is missing {sorted(missing)}")
+
+
+localization_registry = LocalizationRegistry()
+
+
+def get_localization(country) -> Mapping[str, str]:
     """
-    :returns: dict with keys: country, language, domain
+    :returns: read-only mapping with keys: country, language, domain, food, service, athmosphere
     """
-    loc_config = yaml.safe_load(open("localization.yaml"))
-    return {
-        'country': country, 
-        'language': loc_config[country]["language"]["language"],
-        'domain': loc_config[country]["domain"],
-        'food': loc_config[country]["language"]["food"],
-        'service': loc_config[country]["language"]["service"],
-        'athmosphere': loc_config[country]["language"]["athmosphere"]
-    }
-    
-def get_localized_parser(language):
-    loc_config = yaml.safe_load(open("localization.yaml"))
-    return loc_config["review_parser"][language]
+    return localization_registry.localization(country)
+
+
+def get_localized_parser(language) -> Mapping[str, str]:
+    return localization_registry.parser(language)
+
+
+class LocalizationError(Exception):
+    pass
@@ -6,6 +6,25 @@ SERP_QUEUE_NAME = 'serp_queue'
 SERP_BATCH_SIZE = 1
 SERP_QUEUE_MAX_LENGTH = 20
 SERP_QUEUE_MAX_PRIORITY = 10
+# serp_sender --daemon: refill to the target when the queue drops below the low water mark
+SERP_QUEUE_TARGET = 10
+SERP_QUEUE_LOW_WATER = 5
+SERP_DAEMON_POLL_S = 30
+# a sent place is not sent again for this long, or for SERP_SENT_TTL_MARGIN times
+# the time the quota pacing takes to drain a full queue, whichever is longer
+SERP_SENT_TTL_S = 3600
+SERP_SENT_TTL_MARGIN = 2
+# SERP API allowance, see serp_quota.py
+SERP_MONTHLY_QUOTA = 5000
+SERP_QUOTA_RESET_DAY = 8 # day of the month the allowance is renewed
+SERP_QUOTA_BURST = 10 # searches that can go back to back after a quiet spell
+SERP_QUOTA_KEY = "serp_quota"
+# serp_worker.py: "single" handles one message at a time,
+# "concurrent" handles SERP_PREFETCH_COUNT at once and links their entries on SERP_LINK_WORKERS threads
+DEFAULT_SERP_WORKER_MODE = "single"
+SERP_WORKER_MODES = ("single", "concurrent")
+SERP_PREFETCH_COUNT = 2
+SERP_LINK_WORKERS = 8
 
 GMAPS_SCRAPE_QUEUE_MAX_LENGTH = 10
 GMAPS_SCRAPE_QUEUE_MAX_PRIORITY = 10
@@ -18,8 +37,29 @@ VPN_WAIT_TIME_S = 3600 * 24 # how long to wait until we can use VPN again
 EXPIRE_CURR_VPN_S = 60 * 30 # how long current VPN is valid
 VPN_NOTHING_WORKS_SLEEP_S = 3600 * 24 # if no VPN is available, suspend all operations for this time
 CURRENT_VPN_SUFFIX = 'current_vpn'
-PLACE_ID_EXPIRATION_S = 3600
+PLACE_ID_EXPIRATION_S = 3600 # lease of a dispatched place until a worker picks it up
 
 GMAPS_SCRAPER_INTERFACE = {
     "place_id", "data_id", "name", "language", "country_domain", "priority", "last_scraped"
 }
+
+DEFAULT_GMAPS_WORKER_MODE = "single"
+GMAPS_WORKER_MODES = ("single", "interleaved")
+GMAPS_PLACES_IN_FLIGHT = 3 # interleaved mode: how many places a worker scrapes at once
+GMAPS_IDLE_POLL_S = 1.0 # interleaved mode: longest wait for new messages between pages
+
+# GmapsClient candidate buffer, see gmaps_scrape_sender.CandidateBuffer
+GMAPS_PREFETCH_BATCH = 50
+GMAPS_PREFETCH_LOW_WATER = 10
+GMAPS_PREFETCH_MAX_AGE_S = 600
+
+# leases of the places being scraped, see place_leases.py
+PLACE_LEASES_KEY = "place_leases"
+PLACE_LEASE_TTL_S = 60 * 10
+PLACE_LEASE_RENEW_S = 60 * 2
+
+DEFAULT_GMAPS_DISPATCH_MODE = "single"
+GMAPS_DISPATCH_MODES = ("single", "pipelined")
+GMAPS_DISPATCH_POLL_S = 5.0 # pipelined dispatch: longest wait for replies before topping up
+GMAPS_QUEUE_FULL_BACKOFF_S = 10.0 # single dispatch: wait before sending again when the queue is full
+GMAPS_REPLY_TIMEOUT_S = 3600 * 6 # pipelined dispatch: a job without reply after this is forgotten
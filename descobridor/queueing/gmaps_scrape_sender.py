@@ -1,30 +1,88 @@
 import os
+import time
 import uuid
-from typing import Dict, Any
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
 import pika
 import json
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
-from descobridor.queueing.queues import get_auth_connection
-from truby.db_connection import MongoConnection, RedisConnection
+from descobridor.queueing.queues import (
+    get_auth_connection, declare_gmaps_scrape_queue, get_dispatch_mode, get_places_per_worker
+)
+from truby.db_connection import MongoConnection
 from descobridor.queueing.constants import (
     GMAPS_SCRAPE_KEY, GMAPS_SCRAPE_FREQ_D,
-    GMAPS_SCRAPER_INTERFACE
+    GMAPS_SCRAPER_INTERFACE, PLACE_ID_EXPIRATION_S,
+    GMAPS_PREFETCH_BATCH, GMAPS_PREFETCH_LOW_WATER, GMAPS_PREFETCH_MAX_AGE_S,
+    GMAPS_SCRAPE_QUEUE_MAX_PRIORITY, GMAPS_DISPATCH_POLL_S, GMAPS_REPLY_TIMEOUT_S,
+    GMAPS_QUEUE_FULL_BACKOFF_S
 )
 from descobridor.helpers import get_localization
+from descobridor.queueing.place_leases import claim_lease, get_leased_places, release_leases
 from descobridor.the_logger import logger
 
 
 load_dotenv()
 
 
+class CandidateBuffer:
+    """
+    The next places to scrape, fetched GMAPS_PREFETCH_BATCH at a time with one sorted query
+    and handed out in priority order.
+    It's refilled when it drops below GMAPS_PREFETCH_LOW_WATER or gets older than
+    GMAPS_PREFETCH_MAX_AGE_S, so new high priority places still go first.
+    Places in flight are skipped here instead of in the query:
+    the leased ones are read once per refill, and a place is handed out only if we manage
+    to claim its lease, for PLACE_ID_EXPIRATION_S, until a worker picks it up and holds it.
+    """
+    def __init__(
+        self,
+        language: str,
+        batch_size: int = GMAPS_PREFETCH_BATCH,
+        low_water: int = GMAPS_PREFETCH_LOW_WATER,
+        max_age_s: float = GMAPS_PREFETCH_MAX_AGE_S
+        ):
+        self.language = language
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_age_s = max_age_s
+        self.candidates: Deque[Dict[str, Any]] = deque()
+        self._filled_at = float("-inf")
+
+    def pop(self) -> Dict[str, Any]:
+        if len(self.candidates) < self.low_water or time.monotonic() - self._filled_at > self.max_age_s:
+            self.refill()
+        while self.candidates:
+            doc = self.candidates.popleft()
+            if claim_lease(doc['place_id'], PLACE_ID_EXPIRATION_S):
+                return doc
+        raise IndexError("no places to scrape")
+
+    def refill(self) -> None:
+        in_flight = set(get_leased_places())
+        last_scraped = GmapsClient.loc_last_scraped(self.language)
+        with MongoConnection("places") as db:
+            cursor = db.collection.find(
+                GmapsClient.scrape_conditions(last_scraped),
+                {"place_id", "priority", "name", "data_id", last_scraped}
+                ).sort("priority", -1).limit(self.batch_size + len(in_flight))
+            docs = list(cursor)
+        self.candidates = deque(doc for doc in docs if doc['place_id'] not in in_flight)
+        self._filled_at = time.monotonic()
+        logger.info(f"Prefetched {len(self.candidates)} places, {len(in_flight)} in flight")
+
 
 class GmapsClient:
     def __init__(self, debug=False) -> None:
+        self.candidates: Optional[CandidateBuffer] = None
         if not debug:
             self.connection = get_auth_connection()
             self.channel = self.connection.channel()
+            declare_gmaps_scrape_queue(self.channel)
+            # a full queue rejects the publish, we want to know about it
+            self.channel.confirm_delivery()
 
             result = self.channel.queue_declare(queue='', exclusive=True)
             self.callback_queue = result.method.queue
@@ -36,8 +94,13 @@ class GmapsClient:
 
             self.response = None
             self.corr_id = None
+        # jobs waiting for their reply: correlation_id: (request, when it was sent)
+        self.pending: Dict[str, Tuple[Dict[str, Any], float]] = {}
         
     def on_response(self, ch, method, props, body):
+        sent = self.pending.pop(props.correlation_id, None)
+        if sent is not None:
+            logger.info(f"{sent[0]['name']} done in {time.monotonic() - sent[1]:.0f} s: {body}")
         if self.corr_id == props.correlation_id:
             self.response = body
 
@@ -45,20 +108,77 @@ class GmapsClient:
     def send_request(self):
         request = self.get_request()
         self.response = None
+        self.corr_id = self.publish(request)
+        if self.corr_id is None:
+            return None
+        self.connection.process_data_events(time_limit=None)
+        return self.response
+
+    def publish(self, request: Dict[str, Any]) -> Optional[str]:
+        """
+        :returns: the correlation id of the job, None if the queue is full
+        """
         # below we establish that the fact of sending is unique
         # if we want to make a review unique, we should add the review_id
-        self.corr_id = str(uuid.uuid4())
+        corr_id = str(uuid.uuid4())
         logger.info(f"Sending request {request} to gmaps scrape queue...")
-        self.channel.basic_publish(
-            exchange='',
-            routing_key=GMAPS_SCRAPE_KEY,
-            properties=pika.BasicProperties(
-                reply_to=self.callback_queue,
-                correlation_id=self.corr_id,
-            ),
-            body=json.dumps(request))
-        self.connection.process_data_events(time_limit=None)
-        return self.response
+        try:
+            self.channel.basic_publish(
+                exchange='',
+                routing_key=GMAPS_SCRAPE_KEY,
+                properties=pika.BasicProperties(
+                    reply_to=self.callback_queue,
+                    correlation_id=corr_id,
+                    priority=self.message_priority(request),
+                    delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
+                ),
+                body=json.dumps(request))
+        except pika.exceptions.NackError:
+            logger.warning(f"Gmaps scrape queue is full, {request['name']} not sent")
+            release_leases([request['place_id']])
+            return None
+        self.pending[corr_id] = (request, time.monotonic())
+        return corr_id
+
+    def dispatch(self, target: Optional[int] = None) -> None:
+        """
+        keeps `target` jobs in flight, by default as many as the live workers can take,
+        and sends a new one as soon as a reply comes back.
+        """
+        while True:
+            in_flight = target or self.count_workers()
+            self._forget_lost_jobs()
+            while len(self.pending) < in_flight:
+                try:
+                    request = self.get_request()
+                except IndexError:
+                    logger.info("Nothing to scrape at the moment")
+                    break
+                if self.publish(request) is None:
+                    break
+            self.connection.process_data_events(time_limit=GMAPS_DISPATCH_POLL_S)
+
+    def count_workers(self) -> int:
+        """
+        :returns: how many places the live workers can take at once,
+            an interleaved worker is one consumer with several places in flight
+        """
+        declared = self.channel.queue_declare(queue=GMAPS_SCRAPE_KEY, passive=True)
+        return max(1, declared.method.consumer_count) * get_places_per_worker()
+
+    def _forget_lost_jobs(self) -> None:
+        """
+        replies of jobs sent before a restart of ours never come back
+        """
+        now = time.monotonic()
+        for (corr_id, (request, sent_at)) in list(self.pending.items()):
+            if now - sent_at > GMAPS_REPLY_TIMEOUT_S:
+                logger.warning(f"No reply for {request['name']} after {GMAPS_REPLY_TIMEOUT_S} s")
+                del self.pending[corr_id]
+
+    @staticmethod
+    def message_priority(request: Dict[str, Any]) -> int:
+        return max(0, min(GMAPS_SCRAPE_QUEUE_MAX_PRIORITY, int(request.get('priority') or 0)))
     
     def get_request(self):
         """Get next batch of messages for the queue.
@@ -75,15 +195,10 @@ class GmapsClient:
             eg 'en' or 'es'  
         """
         loc = get_localization(os.environ["country"])
-        logger.info("Getting next batch of messages for gmaps scrape queue...")
-        with MongoConnection("places") as db:
-            last_scraped = self.loc_last_scraped(loc['language'])
-            cursor = db.collection.find(
-                self.scrape_conditions(last_scraped),
-                {"place_id", "priority", "name", "data_id", last_scraped}
-                ).sort("priority", -1).limit(1)
-            docs = list(cursor)
-        return self.prepare_request(docs[0], loc['language'], loc['domain']) 
+        logger.info("Getting next message for gmaps scrape queue...")
+        if self.candidates is None or self.candidates.language != loc['language']:
+            self.candidates = CandidateBuffer(loc['language'])
+        return self.prepare_request(self.candidates.pop(), loc['language'], loc['domain'])
 
     @staticmethod
     def loc_last_scraped(language: str) -> str:
@@ -110,14 +225,9 @@ class GmapsClient:
         """
         out of the vast number of places in the db, we want to select only those
         that have data_id, and have not been scraped 
-        in the last GMAPS_SCRAPE_FREQ_D days
+        in the last GMAPS_SCRAPE_FREQ_D days.
+        Places in flight are not excluded here, CandidateBuffer skips them locally.
         """
-        with RedisConnection() as r:
-            header = "working_on_"
-            keys = r.connection.scan_iter(match=f"{header}*")
-        places_working_on = [k.decode().replace(header, "") for k in keys]
-        logger.info(f"Places working on: {places_working_on}")
-        
         now = datetime.now()
         older_than = str((now - timedelta(days=GMAPS_SCRAPE_FREQ_D)).date())
         conditions = {"data_id": {"$ne": None},
@@ -128,15 +238,20 @@ class GmapsClient:
                     {last_scraped: {"$lt": older_than}}
                 ],
                 }
-        if places_working_on:
-            conditions["place_id"] = {"$nin": places_working_on}
         return conditions
 
 
 if __name__ == "__main__":
+    # a single client, so that its candidate buffer lives across requests
+    client = GmapsClient()
+    if get_dispatch_mode() == "pipelined":
+        target = os.environ.get("gmaps_dispatch_in_flight")
+        client.dispatch(int(target) if target else None)
     while True:
-        client = GmapsClient()
         response = client.send_request()
+        if response is None:
+            # the queue is full, give the workers time instead of claiming the next candidate right away
+            client.connection.sleep(GMAPS_QUEUE_FULL_BACKOFF_S)
         logger.info(response)
         
 
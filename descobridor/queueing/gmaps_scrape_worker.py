@@ -2,28 +2,37 @@ import os
 import sys
 import time
 import json
-from typing import Tuple
+from typing import Any, Dict, NamedTuple, Optional, Tuple
 import pandas as pd
 from scipy.stats import norm
 from datetime import datetime
 import subprocess
+from concurrent.futures import Executor, ThreadPoolExecutor
 import pika
 from pathlib import Path
 from dotenv import load_dotenv
 
 from truby.db_connection import RedisConnection, CosmosConnection, TimeoutError
 
-from descobridor.queueing.queues import get_auth_connection
+from descobridor.queueing.queues import (
+    get_auth_connection, declare_gmaps_scrape_queue, get_worker_mode, get_places_per_worker
+)
+from descobridor.queueing.place_leases import LeaseKeeper
+from descobridor.discovery.http_session import session_manager
+from descobridor.discovery.rate_governor import RateGovernor
 from descobridor.discovery.read_raw_reviews import (
     extract_all_reviews, 
+    PlaceScrape,
     EmptyPageError,
     NoReviewsError,
     GoogleKnowsError,
     ChangeVPNError
 )
+from descobridor.discovery.constants import PAGES_PER_VPN
 from descobridor.queueing.constants import (
     VPN_WAIT_TIME_S, VPN_NOTHING_WORKS_SLEEP_S, CURRENT_VPN_SUFFIX, EXPIRE_CURR_VPN_S,
-    GMAPS_SCRAPER_INTERFACE, GMAPS_SCRAPE_KEY, PLACE_ID_EXPIRATION_S
+    GMAPS_SCRAPER_INTERFACE, GMAPS_SCRAPE_KEY,
+    GMAPS_IDLE_POLL_S
 )
 from descobridor.the_logger import logger
 
@@ -31,13 +40,25 @@ from descobridor.the_logger import logger
 load_dotenv()
 
 
+class InFlightPlace(NamedTuple):
+    scrape: PlaceScrape
+    method: Any
+    props: Any
+
+
 class GmapsWorker:
     def __init__(self, name: str):
         self.name = name
         self.logger = logger
         self.connection = get_auth_connection()
         self.channel = self.connection.channel()
-        self.channel.queue_declare(queue=GMAPS_SCRAPE_KEY)
+        declare_gmaps_scrape_queue(self.channel)
+        # interleaved mode: places being scraped, by delivery tag
+        self.places: Dict[int, InFlightPlace] = {}
+        self._storage: Optional[Executor] = None
+        # pages fetched through the current vpn, by all the places in flight
+        self.vpn_pages = 0
+        self.leases = LeaseKeeper()
         
     @property
     def current_vpn_key(self):
@@ -52,17 +73,16 @@ class GmapsWorker:
         gmaps_entry = json.loads(body)
         assert set(gmaps_entry.keys()) == GMAPS_SCRAPER_INTERFACE
         self.logger.info(" [x] Received %r" % gmaps_entry)
-        self.mark_place_id_as_in_progress(gmaps_entry['place_id'])
+        place_id = gmaps_entry['place_id']
+        self.mark_place_id_as_in_progress(place_id)
         try:
-            extract_all_reviews(gmaps_entry)
+            extract_all_reviews(gmaps_entry, self.make_rate_governor())
         except EmptyPageError:
-            self.kill_current_connection()
-            self.connect_to_a_new_vpn()
+            self.switch_vpn()
             self.logger.warning(" [x] Empty page error")
             ch.basic_nack(delivery_tag = method.delivery_tag)
         except NoReviewsError:
-            self.kill_current_connection()
-            self.connect_to_a_new_vpn()
+            self.switch_vpn()
             self.logger.critical(" [x] No reviews error")
             ch.basic_nack(delivery_tag = method.delivery_tag)
         except GoogleKnowsError:
@@ -74,24 +94,113 @@ class GmapsWorker:
             # self.connect_to_a_new_vpn()
             # ch.basic_nack(delivery_tag = method.delivery_tag)
         except ChangeVPNError:
-            self.kill_current_connection()
-            self.connect_to_a_new_vpn()
+            self.switch_vpn()
             self.logger.critical(" [x] Attempting to change VPN")
             ch.basic_nack(delivery_tag = method.delivery_tag)
         else:
             self.logger.info(" [x] Done")
-            ch.basic_publish(exchange='',
-                        routing_key=props.reply_to,
-                        properties=pika.BasicProperties(
-                            correlation_id=props.correlation_id),
-                        body=str("OK"))
-            ch.basic_ack(delivery_tag = method.delivery_tag)
+            self.leases.release(place_id)
+            self._reply_done(ch, method, props)
+        finally:
+            self.leases.forget(place_id)
         
     def main(self) -> None:
+        if get_worker_mode() == "interleaved":
+            return self.main_interleaved()
         self.channel.basic_qos(prefetch_count=1)
         self.channel.basic_consume(queue=GMAPS_SCRAPE_KEY, on_message_callback=self.callback)
         self.logger.info(' [*] Waiting for messages. To exit press CTRL+C')
         self.channel.start_consuming()
+
+    # interleaved mode
+
+    def main_interleaved(self) -> None:
+        """
+        holds up to `gmaps_places_in_flight` places and always fetches the page of the place
+        whose pacing ran out first. Each place keeps its own pacing and checkpoint,
+        and its message is acked or nacked as soon as the place is done or fails.
+        """
+        places_in_flight = get_places_per_worker()
+        self.channel.basic_qos(prefetch_count=places_in_flight)
+        self.channel.basic_consume(queue=GMAPS_SCRAPE_KEY, on_message_callback=self.admit_place)
+        self.logger.info(f' [*] Scraping up to {places_in_flight} places at once. To exit press CTRL+C')
+        # one storage thread for all the places: a place's writes still run in page order
+        with ThreadPoolExecutor(max_workers=1) as storage:
+            self._storage = storage
+            try:
+                while True:
+                    self.connection.process_data_events(time_limit=self._idle_time())
+                    self.step_next_place()
+            except BaseException:
+                # unacked messages go back to the queue, their stored pages are kept by the checkpoint
+                for place in self.places.values():
+                    place.scrape.flush(raise_errors=False)
+                raise
+
+    def admit_place(self, ch, method, props, body: bytes) -> None:
+        self.ensure_vpn_freshness()
+        gmaps_entry = json.loads(body)
+        assert set(gmaps_entry.keys()) == GMAPS_SCRAPER_INTERFACE
+        self.logger.info(" [x] Received %r" % gmaps_entry)
+        self.mark_place_id_as_in_progress(gmaps_entry['place_id'])
+        scrape = PlaceScrape(gmaps_entry, self._storage, self.make_rate_governor())
+        self.places[method.delivery_tag] = InFlightPlace(scrape, method, props)
+
+    def step_next_place(self) -> None:
+        if not self.places:
+            return
+        place = min(self.places.values(), key=lambda p: p.scrape.next_fetch_at)
+        if place.scrape.next_fetch_at > time.monotonic():
+            return
+        try:
+            if not place.scrape.done:
+                place.scrape.step()
+                self.vpn_pages += 1
+        except (EmptyPageError, NoReviewsError, GoogleKnowsError, ChangeVPNError) as e:
+            del self.places[place.method.delivery_tag]
+            self.leases.forget(place.scrape.request['place_id'])
+            place.scrape.governor.observe(e)
+            place.scrape.flush(raise_errors=False)
+            self.on_place_error(place, e)
+            return
+        if place.scrape.done:
+            del self.places[place.method.delivery_tag]
+            place.scrape.finish()
+            self.leases.release(place.scrape.request['place_id'])
+            self.logger.info(f" [x] Done with {place.scrape.request['name']}")
+            self._reply_done(self.channel, place.method, place.props)
+        if self.vpn_pages > PAGES_PER_VPN:
+            self.logger.info(f" [*] {self.vpn_pages} pages through this VPN, changing it")
+            self.ensure_new_vpn()
+
+    def on_place_error(self, place: InFlightPlace, error: Exception) -> None:
+        """
+        the same handling as in callback, for one of the places in flight
+        """
+        if isinstance(error, GoogleKnowsError):
+            self.logger.critical(" [x] Google knows error")
+            self.kill_current_connection()
+            raise GoogleKnowsError from None
+        self.logger.critical(f" [x] {type(error).__name__} on {place.scrape.request['name']}")
+        self.switch_vpn()
+        self.channel.basic_nack(delivery_tag=place.method.delivery_tag)
+
+    def _idle_time(self) -> float:
+        """
+        how long we can wait for new messages before the next page is due
+        """
+        if not self.places:
+            return GMAPS_IDLE_POLL_S
+        next_fetch_at = min(p.scrape.next_fetch_at for p in self.places.values())
+        return min(GMAPS_IDLE_POLL_S, max(0.0, next_fetch_at - time.monotonic()))
+
+    def _reply_done(self, ch, method, props) -> None:
+        ch.basic_publish(exchange='',
+                    routing_key=props.reply_to,
+                    properties=pika.BasicProperties(
+                        correlation_id=props.correlation_id),
+                    body=str("OK"))
+        ch.basic_ack(delivery_tag = method.delivery_tag)
         
         
     # callback actions (vpn actions)
@@ -113,14 +222,34 @@ class GmapsWorker:
                     return True
         
         self.logger.info(" [*] Changinging the VPN")
-        self.kill_current_connection()
-        
-        is_connected = self.connect_to_a_new_vpn()
+        return self.ensure_new_vpn()
+
+    def ensure_new_vpn(self) -> bool:
+        """
+        switch_vpn, and if there's no vpn to go to, wait a bit and give up
+        rather than scraping without one
+        """
+        is_connected = self.switch_vpn()
         if not is_connected:
             self.logger.error(" [!] No vpn available, waiting a bit")
             time.sleep(VPN_NOTHING_WORKS_SLEEP_S)
             raise NoVPNError("No vpn available")
         return True
+
+    def switch_vpn(self) -> bool:
+        """
+        every vpn change goes through here: the places in flight go on through the new vpn,
+        with its rate bucket and a fresh page count
+        :returns: whether a new vpn is connected
+        """
+        self.kill_current_connection()
+        is_connected = self.connect_to_a_new_vpn()
+        vpn = self.get_current_vpn()
+        for place in self.places.values():
+            place.scrape.governor.vpn = vpn
+            place.scrape.counter = 0
+        self.vpn_pages = 0
+        return is_connected
         
     def is_process_started(self):
         pids = self.get_ovpn_running_pids()
@@ -182,6 +311,8 @@ class GmapsWorker:
             )
         with RedisConnection() as r:
             r.connection.delete(self.current_vpn_key)
+        # connections opened through the old tunnel can't be reused
+        session_manager.reset()
         return True
         
     def connect_to_a_new_vpn(self):
@@ -212,12 +343,26 @@ class GmapsWorker:
         
     
     # callback actions (redis actions)
-    def mark_place_id_as_in_progress(self, place_id):
+    def get_current_vpn(self) -> Optional[str]:
+        """
+        :returns: the config file of the vpn this worker is on, workers on the same one share its rate
+        """
         with RedisConnection() as r:
-            self.logger.info(f" [*] Marking place_id {place_id} as in progress")
-            r.connection.set(
-                f"working_on_{place_id}", "in_progress", ex=PLACE_ID_EXPIRATION_S
-            )
+            vpn_key = r.connection.get(self.current_vpn_key)
+        if vpn_key is None:
+            return None
+        vpn, _ = self._break_vpn_key(vpn_key.decode('utf-8'))
+        return vpn
+
+    def make_rate_governor(self) -> RateGovernor:
+        return RateGovernor.from_env(worker=self.name, vpn=self.get_current_vpn())
+
+    def mark_place_id_as_in_progress(self, place_id):
+        """
+        holds the lease of the place, it's renewed in the background until the place is done
+        """
+        self.logger.info(f" [*] Marking place_id {place_id} as in progress")
+        self.leases.hold(place_id)
             
     # HELPERS
     @staticmethod
@@ -280,6 +425,7 @@ class GmapsWorker:
             r.connection.set(self.current_vpn_key, 
                             self._make_vpn_key(best_vpn, time_slot), 
                             ex=EXPIRE_CURR_VPN_S)
+         session_manager.get(tunnel=self._make_vpn_key(best_vpn, time_slot))
             
 
 if __name__ == '__main__':
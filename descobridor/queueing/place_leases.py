@@ -0,0 +1,121 @@
+"""
+Places being scraped, as leases in one redis sorted set: member place_id, score the expiry timestamp.
+The sender claims a place when it dispatches it, the worker renews the lease
+for as long as it scrapes the place and releases it when it's done.
+A lease that isn't renewed (dead worker) expires, and the place can be dispatched again.
+All the operations are O(log n), instead of a SCAN over the whole keyspace.
+"""
+import threading
+import time
+from typing import Iterable, List, Set
+
+from truby.db_connection import RedisConnection
+from descobridor.queueing.constants import (
+    PLACE_LEASES_KEY,
+    PLACE_LEASE_TTL_S,
+    PLACE_LEASE_RENEW_S,
+    )
+from descobridor.the_logger import logger
+
+
+# KEYS[1]: leases, ARGV: place_id, now, ttl. 1 if claimed, 0 if someone holds it
+CLAIM_SCRIPT = """
+local expiry = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[1]))
+if expiry and expiry > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], tonumber(ARGV[2]) + tonumber(ARGV[3]), ARGV[1])
+return 1
+"""
+
+# KEYS[1]: leases, ARGV: now, ttl, place_ids... pushes the expiry to now + ttl, never earlier
+RENEW_SCRIPT = """
+local expiry = tonumber(ARGV[1]) + tonumber(ARGV[2])
+for i = 3, #ARGV do
+    local current = tonumber(redis.call('ZSCORE', KEYS[1], ARGV[i]))
+    if not current or current < expiry then
+        redis.call('ZADD', KEYS[1], expiry, ARGV[i])
+    end
+end
+return #ARGV - 2
+"""
+
+# KEYS[1]: leases, ARGV: now, place_ids... also drops the leases that expired
+RELEASE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for i = 2, #ARGV do
+    redis.call('ZREM', KEYS[1], ARGV[i])
+end
+return #ARGV - 1
+"""
+
+
+def claim_lease(place_id: str, ttl_s: float = PLACE_LEASE_TTL_S) -> bool:
+    with RedisConnection() as r:
+        claim = r.connection.register_script(CLAIM_SCRIPT)
+        return bool(claim(keys=[PLACE_LEASES_KEY], args=[place_id, time.time(), ttl_s]))
+
+
+def renew_leases(place_ids: Iterable[str], ttl_s: float = PLACE_LEASE_TTL_S) -> None:
+    place_ids = list(place_ids)
+    if not place_ids:
+        return
+    with RedisConnection() as r:
+        renew = r.connection.register_script(RENEW_SCRIPT)
+        renew(keys=[PLACE_LEASES_KEY], args=[time.time(), ttl_s, *place_ids])
+
+
+def release_leases(place_ids: Iterable[str]) -> None:
+    with RedisConnection() as r:
+        release = r.connection.register_script(RELEASE_SCRIPT)
+        release(keys=[PLACE_LEASES_KEY], args=[time.time(), *place_ids])
+
+
+def get_leased_places() -> List[str]:
+    with RedisConnection() as r:
+        leased = r.connection.zrangebyscore(PLACE_LEASES_KEY, time.time(), "+inf")
+    return [place_id.decode('utf-8') for place_id in leased]
+
+
+class LeaseKeeper:
+    """
+    Renews the leases of the places a worker is scraping, from a background thread,
+    so that long places are not dispatched again while they're still being scraped.
+    """
+    def __init__(self, renew_every_s: float = PLACE_LEASE_RENEW_S, ttl_s: float = PLACE_LEASE_TTL_S):
+        self.renew_every_s = renew_every_s
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._place_ids: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def hold(self, place_id: str) -> None:
+        with self._lock:
+            self._place_ids.add(place_id)
+        renew_leases([place_id], self.ttl_s)
+
+    def forget(self, place_id: str) -> None:
+        """
+        stops renewing, the lease runs out on its own.
+        For places that go back to the queue: whoever picks them up next holds them again.
+        """
+        with self._lock:
+            self._place_ids.discard(place_id)
+
+    def release(self, place_id: str) -> None:
+        self.forget(place_id)
+        release_leases([place_id])
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.renew_every_s):
+            with self._lock:
+                place_ids = list(self._place_ids)
+            try:
+                renew_leases(place_ids, self.ttl_s)
+            except Exception as e:
+                logger.error(f" [!] could not renew the leases of {place_ids}: {e!r}")
@@ -3,7 +3,10 @@ import pika
 import os
 from descobridor.queueing.constants import (
     SERP_QUEUE_NAME, SERP_QUEUE_MAX_LENGTH, SERP_QUEUE_MAX_PRIORITY,
-    DIRECT_EXCHANGE
+    DIRECT_EXCHANGE,
+    GMAPS_SCRAPE_KEY, GMAPS_SCRAPE_QUEUE_MAX_LENGTH, GMAPS_SCRAPE_QUEUE_MAX_PRIORITY,
+    DEFAULT_GMAPS_DISPATCH_MODE, GMAPS_DISPATCH_MODES,
+    DEFAULT_GMAPS_WORKER_MODE, GMAPS_WORKER_MODES, GMAPS_PLACES_IN_FLIGHT
 )
 
 
@@ -49,4 +52,63 @@ def bind_client_to_serp_queue(
         queue=SERP_QUEUE_NAME
         )
 
-    
+
+def get_dispatch_mode() -> str:
+    """
+    single: one job at a time, the next one is sent when its reply comes back.
+    pipelined: keeps jobs for every live worker in flight, see GmapsClient.dispatch.
+    Picked by the `gmaps_dispatch_mode` env variable, the sender and the workers have to agree on it.
+    """
+    mode = os.environ.get("gmaps_dispatch_mode", DEFAULT_GMAPS_DISPATCH_MODE)
+    if mode not in GMAPS_DISPATCH_MODES:
+        raise ValueError(f"Dispatch mode {mode} not supported, use one of {GMAPS_DISPATCH_MODES}")
+    return mode
+
+
+def get_worker_mode() -> str:
+    """
+    single: one place at a time, the worker sleeps between its pages.
+    interleaved: several places at once, a page of one of them is fetched
+        while the others wait for their pacing.
+    Picked by the `gmaps_worker_mode` env variable.
+    """
+    mode = os.environ.get("gmaps_worker_mode", DEFAULT_GMAPS_WORKER_MODE)
+    if mode not in GMAPS_WORKER_MODES:
+        raise ValueError(f"Worker mode {mode} not supported, use one of {GMAPS_WORKER_MODES}")
+    return mode
+
+
+def get_places_per_worker() -> int:
+    """
+    how many places a gmaps worker scrapes at once, `gmaps_places_in_flight` in interleaved mode
+    """
+    if get_worker_mode() == "single":
+        return 1
+    return int(os.environ.get("gmaps_places_in_flight", GMAPS_PLACES_IN_FLIGHT))
+
+
+def declare_gmaps_scrape_queue(channel: pika.adapters.blocking_connection.BlockingChannel):
+    """
+    the sender and the workers have to declare it with the same arguments.
+    single mode declares it as it always was.
+    pipelined mode needs a durable, bounded priority queue: rabbitmq refuses to redeclare
+    an existing queue with other arguments (PRECONDITION_FAILED), so before switching
+    an existing deployment to pipelined, stop the sender and the workers and delete the queue once:
+        rabbitmqctl delete_queue gmaps_scrape
+    """
+    if get_dispatch_mode() == "single":
+        return channel.queue_declare(queue=GMAPS_SCRAPE_KEY)
+    try:
+        return channel.queue_declare(
+            queue=GMAPS_SCRAPE_KEY,
+            durable=True,
+            arguments={"x-max-priority": GMAPS_SCRAPE_QUEUE_MAX_PRIORITY,
+                       'x-max-length': GMAPS_SCRAPE_QUEUE_MAX_LENGTH,
+                       'x-overflow': 'reject-publish'}
+            )
+    except pika.exceptions.ChannelClosedByBroker as e:
+        if e.reply_code != 406:
+            raise
+        raise ValueError(
+            f"{GMAPS_SCRAPE_KEY} was declared for single dispatch, delete it before using pipelined"
+            ) from e
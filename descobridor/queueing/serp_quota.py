@@ -0,0 +1,129 @@
+"""
+The monthly SERP API allowance as a redis token bucket, shared by the senders and the workers.
+The bucket refills at quota / length of the billing period, so searches are spread evenly
+over the month, and a period never spends more than the quota.
+Everything is reset on SERP_QUOTA_RESET_DAY, when the allowance is renewed.
+"""
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from truby.db_connection import RedisConnection
+from descobridor.queueing.constants import (
+    SERP_MONTHLY_QUOTA,
+    SERP_QUOTA_RESET_DAY,
+    SERP_QUOTA_BURST,
+    SERP_QUOTA_KEY,
+    )
+
+
+# KEYS[1]: quota hash, ARGV: now, period, quota, rate (tokens/s), burst
+# returns '0' when a search is granted, '-1' when the quota of the period is spent,
+# otherwise how many seconds until the next token, as a string (redis truncates lua numbers)
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local quota = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local burst = tonumber(ARGV[5])
+if redis.call('HGET', KEYS[1], 'period') ~= ARGV[2] then
+    redis.call('HSET', KEYS[1], 'period', ARGV[2], 'used', 0, 'tokens', burst, 'ts', now)
+end
+local used = tonumber(redis.call('HGET', KEYS[1], 'used'))
+if used >= quota then
+    return '-1'
+end
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local ts = tonumber(redis.call('HGET', KEYS[1], 'ts'))
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+if tokens < 1 then
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    return tostring((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'ts', now, 'used', used + 1)
+return '0'
+"""
+
+
+def get_serp_quota() -> int:
+    return int(os.environ.get("serp_monthly_quota", SERP_MONTHLY_QUOTA))
+
+
+def billing_period(now: datetime, reset_day: int = SERP_QUOTA_RESET_DAY) -> Tuple[datetime, datetime]:
+    """
+    :returns: start and end of the period `now` is in
+    """
+    start = now.replace(day=reset_day, hour=0, minute=0, second=0, microsecond=0)
+    if now < start:
+        start = _add_months(start, -1)
+    return start, _add_months(start, 1)
+
+
+def _add_months(moment: datetime, months: int) -> datetime:
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+
+class SerpQuota:
+    def __init__(
+        self,
+        quota: Optional[int] = None,
+        reset_day: int = SERP_QUOTA_RESET_DAY,
+        burst: int = SERP_QUOTA_BURST
+        ):
+        self.quota = quota if quota is not None else get_serp_quota()
+        self.reset_day = reset_day
+        self.burst = burst
+
+    def seconds_per_search(self) -> float:
+        """
+        the pace the bucket refills at, in the current period
+        """
+        start, end = billing_period(datetime.now(), self.reset_day)
+        return (end - start).total_seconds() / self.quota
+
+    def acquire(self) -> float:
+        """
+        takes one search from the budget
+        :returns: 0 if granted, otherwise seconds to wait before asking again
+        """
+        now = datetime.now()
+        start, end = billing_period(now, self.reset_day)
+        rate = self.quota / (end - start).total_seconds()
+        with RedisConnection() as r:
+            acquire = r.connection.register_script(ACQUIRE_SCRIPT)
+            wait = float(acquire(
+                keys=[SERP_QUOTA_KEY],
+                args=[time.time(), start.date().isoformat(), self.quota, rate, self.burst]
+            ))
+        if wait < 0:
+            return (end - now).total_seconds()
+        return wait
+
+    def exhaust(self) -> None:
+        """
+        SERP says we're out of requests, whatever we counted: nothing more until the reset
+        """
+        start, _ = billing_period(datetime.now(), self.reset_day)
+        with RedisConnection() as r:
+            r.connection.hset(SERP_QUOTA_KEY, mapping={
+                'period': start.date().isoformat(), 'used': self.quota, 'tokens': 0, 'ts': time.time()
+            })
+
+    def state(self) -> Dict[str, float]:
+        """
+        :returns: used and remaining searches of the current period, without taking any
+        """
+        start, end = billing_period(datetime.now(), self.reset_day)
+        with RedisConnection() as r:
+            stored = r.connection.hgetall(SERP_QUOTA_KEY)
+        stored = {k.decode('utf-8'): v.decode('utf-8') for k, v in stored.items()}
+        used = int(float(stored['used'])) if stored.get('period') == start.date().isoformat() else 0
+        return {
+            'used': used,
+            'remaining': max(0, self.quota - used),
+            'seconds_until_reset': (end - datetime.now()).total_seconds(),
+        }
+
+    def is_exhausted(self) -> bool:
+        return self.state()['remaining'] == 0
@@ -1,8 +1,11 @@
 # cron job: every 10 minutes
 # cron settings: */10 * * * *
+# or as a daemon, that keeps serp_queue topped up: serp_sender.py --daemon
+import argparse
 import os
 import sys
-from typing import Dict, List
+import time
+from typing import Dict, Iterable, List
 import pika
 import json
 from pathlib import Path
@@ -13,47 +16,121 @@ load_dotenv()
 scrptdir = Path(os.environ["repo_path"]).expanduser()
 os.chdir(scrptdir)
 
-from descobridor.queueing.constants import SERP_QUEUE_NAME, DIRECT_EXCHANGE, SERP_BATCH_SIZE # noqa E402
+from descobridor.queueing.constants import ( # noqa E402
+    SERP_QUEUE_NAME, DIRECT_EXCHANGE, SERP_BATCH_SIZE,
+    SERP_QUEUE_TARGET, SERP_QUEUE_LOW_WATER, SERP_DAEMON_POLL_S, SERP_SENT_TTL_S, SERP_SENT_TTL_MARGIN
+)
 from descobridor.queueing.queues import serp_queue # noqa E402
+from descobridor.queueing.serp_quota import SerpQuota # noqa E402
 from truby.db_connection import MongoConnection # noqa E402
+from descobridor.the_logger import logger # noqa E402
 
 
-def get_next_batch() -> List[Dict]:
-    """Get next batch of messages for the queue."""
+def get_next_batch(batch_size: int = SERP_BATCH_SIZE, exclude: Iterable[str] = ()) -> List[Dict]:
+    """Get next batch of messages for the queue.
+    :param exclude: place_ids already sent, that the worker may not have done yet"""
+    query = {"data_id": None, "unserpable": {"$ne": True}}
+    exclude = list(exclude)
+    if exclude:
+        query["place_id"] = {"$nin": exclude}
     with MongoConnection("places") as db:
         cursor = db.collection.find(
-            {"data_id": None, "unserpable": {"$ne": True}}, 
+            query,
             {"place_id", "priority", "name", "coords", "data_id"}
-            ).sort("priority", -1).limit(SERP_BATCH_SIZE)
+            ).sort("priority", -1).limit(batch_size)
         documents = list(cursor)
         [doc.pop("_id") for doc in documents]
         return documents
     
     
-def append_to_queue(channel: pika.adapters.blocking_connection.BlockingChannel, next_batch: List[Dict]):
-    """Append messages to the queue."""
-    for doc in next_batch:
+def append_to_queue(
+    channel: pika.adapters.blocking_connection.BlockingChannel,
+    next_batch: List[Dict]
+    ) -> int:
+    """Append messages to the queue.
+    :returns: how many were accepted, the queue rejects the rest once it's full"""
+    for (sent, doc) in enumerate(next_batch):
         message = json.dumps(doc)
-        channel.basic_publish(
-            exchange=DIRECT_EXCHANGE,
-            routing_key=SERP_QUEUE_NAME,
-            body=message,
-            mandatory=True,
-            properties=pika.BasicProperties(
-                delivery_mode = pika.spec.PERSISTENT_DELIVERY_MODE
-        ))
-        
-        
+        try:
+            channel.basic_publish(
+                exchange=DIRECT_EXCHANGE,
+                routing_key=SERP_QUEUE_NAME,
+                body=message,
+                mandatory=True,
+                properties=pika.BasicProperties(
+                    delivery_mode = pika.spec.PERSISTENT_DELIVERY_MODE
+            ))
+        except pika.exceptions.NackError:
+            logger.warning(f"serp queue is full after {sent} messages")
+            return sent
+    return len(next_batch)
+
+
+def queue_depth(channel: pika.adapters.blocking_connection.BlockingChannel) -> int:
+    """messages waiting in the queue, not counting the ones a worker is on"""
+    return channel.queue_declare(queue=SERP_QUEUE_NAME, passive=True).method.message_count
+
+
+def sent_ttl(quota: SerpQuota) -> float:
+    """
+    the workers take a search every quota.seconds_per_search(),
+    so a full queue takes SERP_QUEUE_TARGET of those to drain
+    """
+    return max(SERP_SENT_TTL_S, SERP_SENT_TTL_MARGIN * SERP_QUEUE_TARGET * quota.seconds_per_search())
+
+
+def run_daemon() -> None:
+    """
+    keeps one connection, and tops the queue up to SERP_QUEUE_TARGET messages
+    whenever it drops below SERP_QUEUE_LOW_WATER, with one query per refill.
+    Sent places are not sent again while they can still be waiting in the queue,
+    they have no data_id until a worker gets to them. See sent_ttl.
+    Nothing is sent while the SERP quota of the month is spent, what's queued stays there.
+    """
+    connection, channel, queue_name = serp_queue()
+    quota = SerpQuota()
+    ttl = sent_ttl(quota)
+    # place_id: when it was sent
+    sent: Dict[str, float] = {}
+    try:
+        while True:
+            depth = queue_depth(channel)
+            if depth < SERP_QUEUE_LOW_WATER and not quota.is_exhausted():
+                now = time.monotonic()
+                sent = {place_id: at for (place_id, at) in sent.items() if now - at < ttl}
+                next_batch = get_next_batch(SERP_QUEUE_TARGET - depth, sent)
+                accepted = append_to_queue(channel, next_batch)
+                sent.update((doc["place_id"], now) for doc in next_batch[:accepted])
+                logger.info(f"serp queue at {depth}, sent {accepted}")
+            connection.sleep(SERP_DAEMON_POLL_S)
+    finally:
+        connection.close()
+
+
 def main() -> None:
+    if SerpQuota().is_exhausted():
+        logger.info("SERP quota spent, nothing to send until it resets")
+        return
     connection, channel, queue_name = serp_queue()
-    next_batch = get_next_batch()
-    append_to_queue(channel, next_batch)
+    # what's still queued would be sent again, and every duplicate spends a search
+    depth = queue_depth(channel)
+    if depth < SERP_QUEUE_LOW_WATER:
+        next_batch = get_next_batch()
+        append_to_queue(channel, next_batch)
+    else:
+        logger.info(f"serp queue at {depth}, nothing sent")
     connection.close()
         
         
 if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument("--daemon", action="store_true", help="keep the queue topped up instead of a cron run")
+    arguments = args.parse_args()
     try:
-        main()
+        if arguments.daemon:
+            run_daemon()
+        else:
+            main()
     except KeyboardInterrupt:
         print('Interrupted')
         try:
@@ -1,42 +1,139 @@
 import sys
 import os
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 import json
+from typing import Optional
 
     
 
 from descobridor.queueing.queues import serp_queue, bind_client_to_serp_queue
-from descobridor.queueing.constants import SERP_QUEUE_NAME
+from descobridor.queueing.constants import (
+    DEFAULT_SERP_WORKER_MODE, SERP_WORKER_MODES, SERP_PREFETCH_COUNT, SERP_LINK_WORKERS
+)
+from descobridor.queueing.serp_quota import SerpQuota
 from descobridor.discovery.serp_api import serp_search_place, OutOfRequestsError
-from descobridor.queueing.change_serpjob_freq import postpone_job
 from descobridor.the_logger import logger
 
 
-def callback(ch, method, properties, body):
-    logger.info(f" [x] Received {body} at {datetime.now().strftime('%H:%M:%S')}")
-    time.sleep(1)
-    record = json.loads(body)
-    try:
-        _ = serp_search_place(record["place_id"], record["name"], record["coords"], use_cache=True)
-    except OutOfRequestsError:
-        logger.error("Out of requests, postponing job")
-        postpone_job()
-        ch.queue_purge(queue=SERP_QUEUE_NAME)
-        ch.basic_ack(delivery_tag = method.delivery_tag)
-    else:
-        logger.info(f" [x] Done at {datetime.now().strftime('%H:%M:%S')}")
-        ch.basic_ack(delivery_tag = method.delivery_tag)
+def get_worker_mode() -> str:
+    """
+    single: one message at a time, on the connection's thread.
+    concurrent: SERP_PREFETCH_COUNT messages at once on a thread pool, the entries of every
+        SERP response are linked back on SERP_LINK_WORKERS threads.
+    Picked by the `serp_worker_mode` env variable.
+    """
+    mode = os.environ.get("serp_worker_mode", DEFAULT_SERP_WORKER_MODE)
+    if mode not in SERP_WORKER_MODES:
+        raise ValueError(f"Worker mode {mode} not supported, use one of {SERP_WORKER_MODES}")
+    return mode
+
+
+class SerpConsumer:
+    """
+    Takes a search from the SERP quota before every message.
+    When the quota says wait, the message goes back to the queue and we stop consuming
+    until then: nothing is purged, the queue just waits for the allowance.
+    With a pool, messages are handled off the connection's thread, and everything that touches
+    the channel goes back to it through add_callback_threadsafe: pika isn't thread safe.
+    """
+    def __init__(
+        self,
+        quota: SerpQuota,
+        connection=None,
+        pool: Optional[ThreadPoolExecutor] = None,
+        link_pool: Optional[ThreadPoolExecutor] = None
+        ) -> None:
+        self.quota = quota
+        self.connection = connection
+        self.pool = pool
+        self.link_pool = link_pool
+        self.pause_s = 0.0
+        self._pausing = False
+        self._lock = threading.Lock()
+
+    def callback(self, ch, method, properties, body):
+        logger.info(f" [x] Received {body} at {datetime.now().strftime('%H:%M:%S')}")
+        if self.pool is None:
+            self.handle(ch, method.delivery_tag, body)
+        else:
+            self.pool.submit(self.handle_safely, ch, method.delivery_tag, body)
+
+    def handle(self, ch, delivery_tag: int, body: bytes) -> None:
+        wait = self.quota.acquire()
+        if wait > 0:
+            self.pause(ch, delivery_tag, wait)
+            return
+        record = json.loads(body)
+        try:
+            _ = serp_search_place(
+                record["place_id"], record["name"], record["coords"],
+                use_cache=True, link_pool=self.link_pool)
+        except OutOfRequestsError:
+            logger.error("Out of requests, waiting for the quota reset")
+            self.quota.exhaust()
+            self.pause(ch, delivery_tag, self.quota.state()["seconds_until_reset"])
+        else:
+            logger.info(f" [x] Done at {datetime.now().strftime('%H:%M:%S')}")
+            self.on_channel(ch.basic_ack, delivery_tag = delivery_tag)
+
+    def handle_safely(self, ch, delivery_tag: int, body: bytes) -> None:
+        """
+        an error in a pool thread would go nowhere, and the message would stay unacked.
+        It's dropped instead: the place still has no data_id, so the sender sends it again.
+        """
+        try:
+            self.handle(ch, delivery_tag, body)
+        except Exception as e:
+            logger.error(f" [!] {body} failed: {e!r}")
+            self.on_channel(ch.basic_nack, delivery_tag = delivery_tag, requeue=False)
+
+    def pause(self, ch, delivery_tag: int, wait: float) -> None:
+        self.on_channel(ch.basic_nack, delivery_tag = delivery_tag, requeue=True)
+        with self._lock:
+            self.pause_s = max(self.pause_s, wait)
+            if self._pausing:
+                return
+            self._pausing = True
+        logger.info(f" [*] SERP quota: pausing for {wait:.0f} s")
+        self.on_channel(ch.stop_consuming)
+
+    def resume(self) -> None:
+        with self._lock:
+            self.pause_s = 0.0
+            self._pausing = False
+
+    def on_channel(self, method, **kwargs) -> None:
+        if self.pool is None:
+            method(**kwargs)
+        else:
+            self.connection.add_callback_threadsafe(partial(method, **kwargs))
 
 
 def main():
     connection, channel, queue_name = serp_queue()
     bind_client_to_serp_queue(channel)
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=False)
-
+    if get_worker_mode() == "concurrent":
+        channel.basic_qos(prefetch_count=SERP_PREFETCH_COUNT)
+        consumer = SerpConsumer(
+            SerpQuota(),
+            connection,
+            pool=ThreadPoolExecutor(max_workers=SERP_PREFETCH_COUNT),
+            link_pool=ThreadPoolExecutor(max_workers=SERP_LINK_WORKERS))
+    else:
+        # one message at a time, the others stay in the queue while we pause
+        channel.basic_qos(prefetch_count=1)
+        consumer = SerpConsumer(SerpQuota())
 
-    logger.info(' [*] Waiting for messages. To exit press CTRL+C')
-    channel.start_consuming()
+    while True:
+        channel.basic_consume(queue=queue_name, on_message_callback=consumer.callback, auto_ack=False)
+        logger.info(' [*] Waiting for messages. To exit press CTRL+C')
+        channel.start_consuming()
+        # keeps the heartbeats going while we wait, and runs the acks of messages still in flight
+        connection.sleep(consumer.pause_s)
+        consumer.resume()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,70 @@
+"""
+Stand-ins for the datastores, so that the scraping and queueing logic runs without them:
+fakeredis (with lupa for the lua scripts) for redis, mongomock for mongo and cosmos.
+"""
+import importlib
+import os
+from types import SimpleNamespace
+
+import fakeredis
+import mongomock
+import pytest
+
+# the_logger names its log after the worker
+os.environ.setdefault("worker_name", "tests")
+
+
+# modules that open their own connections, patched by the datastores fixture
+CONNECTION_USERS = (
+    "descobridor.discovery.read_raw_reviews",
+    "descobridor.discovery.rate_governor",
+    "descobridor.queueing.place_leases",
+    "descobridor.queueing.serp_quota",
+    "descobridor.queueing.gmaps_scrape_sender",
+    "descobridor.queueing.gmaps_scrape_worker",
+)
+
+
+class FakeRedisConnection:
+    def __init__(self, redis):
+        self.connection = redis
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeMongoConnection:
+    def __init__(self, database, collection: str):
+        self.collection = database[collection]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def df_to_collection_omit_duplicated(self, df):
+        for record in df.to_dict("records"):
+            if self.collection.find_one({"unique_review_id": record["unique_review_id"]}) is None:
+                self.collection.insert_one(record)
+
+
+@pytest.fixture
+def datastores(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    client = mongomock.MongoClient()
+    stores = SimpleNamespace(redis=redis, mongo=client["mongo"], cosmos=client["cosmos"])
+    for name in CONNECTION_USERS:
+        module = importlib.import_module(name)
+        if hasattr(module, "RedisConnection"):
+            monkeypatch.setattr(module, "RedisConnection", lambda: FakeRedisConnection(redis))
+        if hasattr(module, "MongoConnection"):
+            monkeypatch.setattr(
+                module, "MongoConnection", lambda coll: FakeMongoConnection(stores.mongo, coll))
+        if hasattr(module, "CosmosConnection"):
+            monkeypatch.setattr(
+                module, "CosmosConnection", lambda coll: FakeMongoConnection(stores.cosmos, coll))
+    return stores
@@ -0,0 +1,49 @@
+from datetime import date, timedelta
+from unittest.mock import Mock
+
+from descobridor.discovery import read_raw_reviews as rrr
+
+
+PLACE = {
+    "place_id": "p1",
+    "data_id": "0x1:0x2",
+    "language": "en",
+    "name": "cafe",
+    "country_domain": "com",
+    "last_scraped": str(date.today() - timedelta(days=60)),
+}
+
+
+def days_ago(days: int) -> str:
+    return str(date.today() - timedelta(days=days))
+
+
+def test_resumes_after_the_checkpoint(datastores):
+    rrr.checkpoint_to_redis(PLACE, 3, "token4", watermark=days_ago(10))
+    scrape = rrr.PlaceScrape(PLACE, governor=Mock())
+    assert (scrape.page_number, scrape.next_page_token, scrape.done) == (4, "token4", False)
+
+
+def test_watermark_before_last_scrape_is_done(datastores):
+    rrr.checkpoint_to_redis(PLACE, 3, "token4", watermark=days_ago(90))
+    assert rrr.PlaceScrape(PLACE, governor=Mock()).done
+
+
+def test_legacy_checkpoint_only_in_the_migration_window(datastores, monkeypatch):
+    datastores.redis.set(rrr._successful_page_key(PLACE), 2)
+    datastores.cosmos["raw_reviews"].insert_one(
+        {"place_id": "p1", "page_number": 2, "next_page_token": "token3"})
+    assert rrr.get_page_num_and_page_token(PLACE, None) == (0, "")
+    monkeypatch.setenv("legacy_checkpoints", "true")
+    assert rrr.get_page_num_and_page_token(PLACE, None) == (3, "token3")
+
+
+def test_finish_clears_the_checkpoint(datastores):
+    datastores.mongo["places"].insert_one({"place_id": "p1"})
+    rrr.checkpoint_to_redis(PLACE, 3, "token4", ["p1_ana_en"], days_ago(10))
+    scrape = rrr.PlaceScrape(PLACE, governor=Mock())
+
+    scrape.finish()
+
+    assert rrr.get_checkpoint_from_redis(PLACE) is None
+    assert datastores.mongo["places"].find_one({"place_id": "p1"})["review_extr_ds_en"] == str(date.today())
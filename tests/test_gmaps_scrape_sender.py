@@ -0,0 +1,62 @@
+from datetime import date
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from descobridor.queueing.gmaps_scrape_sender import CandidateBuffer, GmapsClient
+from descobridor.queueing.place_leases import claim_lease, get_leased_places
+
+
+@pytest.fixture
+def client():
+    client = GmapsClient(debug=True)
+    client.channel = Mock()
+    client.channel.queue_declare.return_value = SimpleNamespace(method=SimpleNamespace(consumer_count=2))
+    return client
+
+
+def test_count_workers_single_workers(client, monkeypatch):
+    monkeypatch.setenv("gmaps_worker_mode", "single")
+    assert client.count_workers() == 2
+
+
+def test_count_workers_fills_interleaved_workers(client, monkeypatch):
+    monkeypatch.setenv("gmaps_worker_mode", "interleaved")
+    monkeypatch.setenv("gmaps_places_in_flight", "3")
+    assert client.count_workers() == 6
+
+
+def place(place_id: str, priority: int, **fields) -> dict:
+    return {"place_id": place_id, "priority": priority, "name": place_id, "data_id": "d", **fields}
+
+
+def test_candidates_in_priority_order_without_places_in_flight(datastores):
+    datastores.mongo["places"].insert_many([
+        place("low", 1), place("high", 9), place("mid", 5), place("no_data_id", 10, data_id=None),
+        place("fresh", 8, review_extr_ds_en=str(date.today())),
+    ])
+    claim_lease("mid")
+    buffer = CandidateBuffer("en", batch_size=10, low_water=0)
+
+    assert [buffer.pop()["place_id"] for _ in range(2)] == ["high", "low"]
+    assert set(get_leased_places()) == {"high", "mid", "low"}
+    with pytest.raises(IndexError):
+        buffer.pop()
+
+
+def test_candidate_claimed_by_another_sender_is_skipped(datastores):
+    datastores.mongo["places"].insert_many([place("a", 9), place("b", 5)])
+    buffer = CandidateBuffer("en", batch_size=10, low_water=0)
+    buffer.refill()
+    claim_lease("a")
+    assert buffer.pop()["place_id"] == "b"
+
+
+def test_candidates_refilled_below_low_water(datastores):
+    datastores.mongo["places"].insert_many([place(f"p{i}", i) for i in range(6)])
+    buffer = CandidateBuffer("en", batch_size=3, low_water=2)
+    assert [buffer.pop()["place_id"] for _ in range(2)] == ["p5", "p4"]
+    # one left, below the low water: the refill sees p5 and p4 in flight
+    assert buffer.pop()["place_id"] == "p3"
+    assert len(buffer.candidates) == 2
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+from unittest.mock import Mock
+
+import pytest
+
+from descobridor.discovery.constants import PAGES_PER_VPN
+from descobridor.queueing.gmaps_scrape_worker import GmapsWorker, InFlightPlace
+
+
+def in_flight(tag: int) -> InFlightPlace:
+    scrape = SimpleNamespace(
+        governor=SimpleNamespace(vpn="old.ovpn"),
+        counter=4,
+        done=False,
+        next_fetch_at=0.0,
+        request={"place_id": f"p{tag}", "name": f"place {tag}"},
+    )
+    scrape.step = Mock()
+    return InFlightPlace(scrape, SimpleNamespace(delivery_tag=tag), None)
+
+
+@pytest.fixture
+def worker():
+    # no rabbitmq, vpn or redis behind it
+    worker = GmapsWorker.__new__(GmapsWorker)
+    worker.logger = Mock()
+    worker.places = {1: in_flight(1), 2: in_flight(2)}
+    worker.vpn_pages = 0
+    worker.kill_current_connection = Mock()
+    worker.connect_to_a_new_vpn = Mock(return_value=True)
+    worker.get_current_vpn = Mock(return_value="new.ovpn")
+    return worker
+
+
+def test_switch_vpn_rebinds_every_place(worker):
+    worker.vpn_pages = 7
+    assert worker.switch_vpn()
+    assert [p.scrape.governor.vpn for p in worker.places.values()] == ["new.ovpn", "new.ovpn"]
+    assert [p.scrape.counter for p in worker.places.values()] == [0, 0]
+    assert worker.vpn_pages == 0
+
+
+def test_stale_vpn_on_admission_rebinds_every_place(worker, datastores):
+    worker.name = "w1"
+    worker.ensure_vpn_freshness()
+    assert [p.scrape.governor.vpn for p in worker.places.values()] == ["new.ovpn", "new.ovpn"]
+
+
+def test_pages_are_counted_across_places(worker):
+    for _ in range(PAGES_PER_VPN):
+        worker.step_next_place()
+    worker.connect_to_a_new_vpn.assert_not_called()
+    worker.step_next_place()
+    worker.connect_to_a_new_vpn.assert_called_once()
+    assert worker.vpn_pages == 0
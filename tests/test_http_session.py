@@ -0,0 +1,13 @@
+from descobridor.discovery.http_session import ReviewSessionManager
+
+
+def test_default_headers_are_python_requests(monkeypatch):
+    monkeypatch.delenv("google_request_headers", raising=False)
+    session = ReviewSessionManager().get()
+    assert session.headers["User-Agent"].startswith("python-requests/")
+
+
+def test_browser_headers(monkeypatch):
+    monkeypatch.setenv("google_request_headers", "browser")
+    session = ReviewSessionManager().get()
+    assert "Chrome/" in session.headers["User-Agent"]
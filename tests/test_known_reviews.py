@@ -0,0 +1,50 @@
+from descobridor.discovery import read_raw_reviews as rrr
+
+
+PLACE = {
+    "place_id": "p1",
+    "language": "en",
+    "name": "cafe",
+    "last_scraped": "2023-03-01",
+}
+
+
+def review(reviewer: str, scrape_ds: str) -> dict:
+    return {
+        "place_id": "p1",
+        "language": "en",
+        "unique_review_id": f"p1_{reviewer}_en",
+        "scrape_ds": scrape_ds,
+    }
+
+
+def test_restart_after_interrupted_scrape_knows_only_finished_reviews(datastores):
+    # finished on 2023-03-01
+    datastores.mongo["reviews"].insert_many([review("ana", "2023-03-01"), review("bo", "2023-03-01")])
+    # rescraped on 2023-04-08, interrupted after its first flush
+    datastores.mongo["reviews"].insert_many([review("cy", "2023-04-08"), review("di", "2023-04-08")])
+    rrr.checkpoint_to_redis(PLACE, 0, "token", ["p1_cy_en", "p1_di_en"])
+    # the checkpoint is gone, the place starts over
+    datastores.redis.delete(rrr._checkpoint_key(PLACE))
+
+    known = rrr.get_known_reviews(PLACE)
+
+    assert known == {"p1_ana_en", "p1_bo_en"}
+    assert {i.decode() for i in datastores.redis.smembers(rrr._known_reviews_key(PLACE))} == known
+
+
+def test_known_reviews_grow_only_when_the_scrape_finishes(datastores):
+    datastores.mongo["reviews"].insert_one(review("ana", "2023-03-01"))
+    assert rrr.get_known_reviews(PLACE) == {"p1_ana_en"}
+    rrr.checkpoint_to_redis(PLACE, 0, "token", ["p1_cy_en"])
+    assert rrr.get_known_reviews(PLACE) == {"p1_ana_en"}
+
+    rrr.commit_known_reviews(PLACE)
+
+    assert rrr.get_known_reviews(PLACE) == {"p1_ana_en", "p1_cy_en"}
+
+
+def test_never_finished_place_has_no_known_reviews(datastores):
+    datastores.mongo["reviews"].insert_one(review("cy", "2023-04-08"))
+    assert rrr.get_known_reviews({**PLACE, "last_scraped": None}) == set()
+    assert rrr.get_known_reviews({**PLACE, "last_scraped": "2017-01-01"}) == set()
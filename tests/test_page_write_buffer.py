@@ -0,0 +1,57 @@
+import pandas as pd
+
+from descobridor.discovery import read_raw_reviews as rrr
+
+
+PLACE = {"place_id": "p1", "language": "en", "name": "cafe"}
+
+
+def page(page_number: int, reviewers, review_date: str):
+    record = rrr.make_page_record(
+        "p1", "d1", "cafe", "en", page_number, f"<html>page {page_number}</html>", f"token{page_number + 1}")
+    reviews = pd.DataFrame({
+        "unique_review_id": [f"p1_{reviewer}_en" for reviewer in reviewers],
+        "review_date": pd.to_datetime([review_date] * len(reviewers)),
+    })
+    return record, reviews, page_number
+
+
+def test_pages_wait_for_the_batch(datastores):
+    buffer = rrr.PageWriteBuffer(PLACE, max_pages=2, max_age_s=3600)
+    buffer.add(*page(0, ["ana", "bo"], "2023-04-01"))
+    assert datastores.cosmos["raw_reviews"].count_documents({}) == 0
+    assert rrr.get_checkpoint_from_redis(PLACE) is None
+
+    buffer.add(*page(1, ["cy"], "2023-03-01"))
+
+    assert datastores.cosmos["raw_reviews"].count_documents({}) == 2
+    assert datastores.mongo["reviews"].count_documents({}) == 3
+    assert rrr.get_checkpoint_from_redis(PLACE) == {
+        "page_number": "1", "next_page_token": "token2", "language": "en", "watermark": "2023-03-01"
+    }
+    assert buffer.page_records == [] and buffer.reviews == []
+
+
+def test_old_pages_are_flushed(datastores):
+    buffer = rrr.PageWriteBuffer(PLACE, max_pages=10, max_age_s=0)
+    buffer.add(*page(0, ["ana"], "2023-04-01"))
+    assert rrr.get_checkpoint_from_redis(PLACE)["page_number"] == "0"
+
+
+def test_a_review_on_two_pages_is_stored_once(datastores):
+    buffer = rrr.PageWriteBuffer(PLACE, max_pages=2, max_age_s=3600)
+    buffer.add(*page(0, ["ana", "bo"], "2023-04-01"))
+    buffer.add(*page(1, ["bo", "cy"], "2023-04-01"))
+    stored = [r["unique_review_id"] for r in datastores.mongo["reviews"].find()]
+    assert sorted(stored) == ["p1_ana_en", "p1_bo_en", "p1_cy_en"]
+
+
+def test_unflushed_pages_do_not_move_the_checkpoint(datastores):
+    buffer = rrr.PageWriteBuffer(PLACE, max_pages=2, max_age_s=3600)
+    buffer.add(*page(0, ["ana"], "2023-04-01"))
+    buffer.add(*page(1, ["bo"], "2023-04-01"))
+    buffer.add(*page(2, ["cy"], "2023-03-01"))
+    # the worker dies here: page 2 is scraped again from the checkpoint
+    assert rrr.get_page_num_and_page_token(PLACE, rrr.get_checkpoint_from_redis(PLACE)) == (2, "token2")
+    pending = datastores.redis.smembers(rrr._pending_known_reviews_key(PLACE))
+    assert {i.decode() for i in pending} == {"p1_ana_en", "p1_bo_en"}
@@ -0,0 +1,59 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from descobridor.queueing import place_leases as pl
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    the time the leases see, moved by hand
+    """
+    now = [1_000_000.0]
+    monkeypatch.setattr(pl, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_claim_is_exclusive_until_the_lease_expires(datastores, clock):
+    assert pl.claim_lease("p1", ttl_s=60)
+    assert not pl.claim_lease("p1", ttl_s=60)
+    assert pl.get_leased_places() == ["p1"]
+    clock[0] += 61
+    assert pl.get_leased_places() == []
+    assert pl.claim_lease("p1", ttl_s=60)
+
+
+def test_renew_pushes_the_expiry_never_earlier(datastores, clock):
+    pl.claim_lease("p1", ttl_s=600)
+    pl.renew_leases(["p1", "p2"], ttl_s=60)
+    clock[0] += 120
+    # p1 keeps its longer lease, p2 was leased by the renewal and ran out
+    assert pl.get_leased_places() == ["p1"]
+    pl.renew_leases(["p1"], ttl_s=600)
+    clock[0] += 590
+    assert pl.get_leased_places() == ["p1"]
+
+
+def test_release_frees_the_place_and_drops_expired_leases(datastores, clock):
+    pl.claim_lease("p1", ttl_s=600)
+    pl.claim_lease("old", ttl_s=10)
+    clock[0] += 20
+    pl.release_leases(["p1"])
+    assert datastores.redis.zcard(pl.PLACE_LEASES_KEY) == 0
+    assert pl.claim_lease("p1", ttl_s=600)
+
+
+def test_lease_keeper_renews_held_places(datastores):
+    keeper = pl.LeaseKeeper(renew_every_s=0.05, ttl_s=0.2)
+    try:
+        keeper.hold("p1")
+        keeper.hold("p2")
+        keeper.forget("p2")
+        time.sleep(0.4)
+        assert pl.get_leased_places() == ["p1"]
+        keeper.release("p1")
+        assert pl.get_leased_places() == []
+    finally:
+        keeper.stop()
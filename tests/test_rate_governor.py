@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import pytest
+
+from descobridor.discovery import rate_governor as rg
+from descobridor.discovery.read_raw_reviews import ChangeVPNError, GoogleKnowsError, RateLimitedError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    the time the buckets see, moved by hand
+    """
+    now = [1_000_000.0]
+    monkeypatch.setattr(rg, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def governor(datastores, clock):
+    policy = rg.get_pacing_policy("adaptive")._replace(jitter_s=0)
+    return rg.RateGovernor("w1", "vpn1", policy)
+
+
+def vpn_rate(datastores) -> float:
+    """
+    pages per minute of the vpn bucket
+    """
+    return float(datastores.redis.hget("rate_bucket_vpn_vpn1", "rate")) * 60
+
+
+def test_token_bucket_paces_after_the_burst(governor, clock):
+    # burst of 1: the first page goes right away, the vpn (6 pages/min) is slower than the worker
+    assert governor.wait() == 0
+    assert governor.wait() == pytest.approx(10)
+    # the reserved token is back after those 10 s, then the next one needs another 10
+    clock[0] += 10
+    assert governor.wait() == pytest.approx(10)
+    clock[0] += 60
+    assert governor.wait() == 0
+
+
+def test_workers_on_a_vpn_share_its_bucket(governor, datastores):
+    other = rg.RateGovernor("w2", "vpn1", governor.policy)
+    assert governor.wait() == 0
+    assert other.wait() == pytest.approx(10)
+
+
+def test_rate_grows_after_good_pages(governor, datastores):
+    governor.wait()
+    governor.observe()
+    governor.observe()
+    assert vpn_rate(datastores) == pytest.approx(6.5)
+
+
+def test_rate_drops_after_google_knows(governor, datastores):
+    governor.wait()
+    governor.observe(GoogleKnowsError("google knows"))
+    assert vpn_rate(datastores) == pytest.approx(1.5)
+    governor.observe(GoogleKnowsError("google knows"))
+    # not below min_rate
+    assert vpn_rate(datastores) == pytest.approx(1)
+
+
+def test_rate_limited_halves_the_rate_our_vpn_change_does_not(governor, datastores):
+    governor.wait()
+    governor.observe(ChangeVPNError("change vpn"))
+    assert vpn_rate(datastores) == pytest.approx(6)
+    governor.observe(RateLimitedError("rate limited, status 429"))
+    assert vpn_rate(datastores) == pytest.approx(3)
+
+
+def test_fixed_policy_does_not_touch_redis(datastores):
+    governor = rg.RateGovernor("w1", "vpn1", None)
+    assert governor.wait() > 0
+    governor.observe(GoogleKnowsError("google knows"))
+    assert datastores.redis.keys() == []
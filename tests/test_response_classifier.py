@@ -0,0 +1,31 @@
+import pytest
+
+from descobridor.discovery import response_classifier as rc
+
+
+REVIEW_PAGE = b"<div class='gws-localreviews__google-review'>" + b"x" * 500 + b"</div>"
+SORRY_PAGE = b"<html><form id=\"captcha-form\" action=\"/sorry/index\"></form></html>"
+
+
+@pytest.mark.parametrize("status_code", [403, 429, 503])
+def test_error_status_without_marker_is_rate_limited(status_code):
+    assert rc.classify_response(status_code, {}, b"<html>Service Unavailable</html>") == rc.RATE_LIMITED
+
+
+@pytest.mark.parametrize("status_code", [200, 403, 429, 503])
+def test_block_marker_is_blocked(status_code):
+    assert rc.classify_response(status_code, {}, SORRY_PAGE) == rc.BLOCKED
+
+
+def test_sorry_redirect_is_blocked():
+    url = "https://www.google.com/sorry/index?continue=https://www.google.com/async/reviewDialog"
+    assert rc.classify_response(200, {}, REVIEW_PAGE, url) == rc.BLOCKED
+
+
+def test_other_errors_and_short_pages_are_empty():
+    assert rc.classify_response(404, {}, REVIEW_PAGE) == rc.EMPTY
+    assert rc.classify_response(200, {}, b"<html></html>") == rc.EMPTY
+
+
+def test_review_page_is_ok():
+    assert rc.classify_response(200, {}, REVIEW_PAGE) == rc.OK
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from descobridor.discovery.review_age import review_age_columns
+
+
+def test_review_age_columns():
+    times = pd.Series(["a week ago", "3 months ago", "a week ago"])
+    scrape_ds = pd.Series(["2023-04-08"] * 3)
+    ages = review_age_columns(times, scrape_ds, "en")
+    assert ages["days_before_scrape"].tolist() == [7, 90, 7]
+    assert ages["review_date"].tolist() == list(pd.to_datetime(["2023-04-01", "2023-01-08", "2023-04-01"]))
+    assert ages["age_precision"].tolist() == [7, 30, 7]
+
+
+def test_review_age_columns_missing_time():
+    times = pd.Series(["a week ago", None, "3 months ago", np.nan])
+    scrape_ds = pd.Series(["2023-04-08"] * 4)
+    ages = review_age_columns(times, scrape_ds, "en")
+    assert ages["days_before_scrape"].isna().tolist() == [False, True, False, True]
+    assert ages["review_date"].isna().tolist() == [False, True, False, True]
+    assert ages["age_precision"].isna().tolist() == [False, True, False, True]
+    assert ages["review_date"].iat[2] == pd.Timestamp("2023-01-08")
+
+
+def test_review_age_columns_all_missing():
+    ages = review_age_columns(pd.Series([None, None]), pd.Series(["2023-04-08"] * 2), "en")
+    assert ages["review_date"].isna().all()
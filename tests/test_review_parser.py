@@ -0,0 +1,54 @@
+import pandas as pd
+
+from descobridor.discovery import review_parser as rp
+
+
+TIMES = ["a week ago", "2 months ago", "3 days ago"]
+COLUMNS = ["reviewer_name", "time", "stars", "review_original", "review_date", "unique_review_id"]
+
+
+def review_block(i: int, name: bool = True, time: bool = True) -> str:
+    reviewer = f'<div class="TSUbDb"><a href="#">User {i}</a></div>' if name else ''
+    when = f'<span class="dehysf">{TIMES[i % 3]}</span>' if time else ''
+    return (
+        f'<div class="gws-localreviews__google-review WMbnJf">{reviewer}'
+        f'<div class="PuaHbe"><span class="lTi8oc z3HNkc" aria-label="Rated {1 + i % 5}.0 out of 5,">'
+        f'</span>{when}</div>'
+        f'<div class="Jtu6Td"><span class="review-full-text" style="display:none">Review number {i}</span>'
+        '</div></div>'
+    )
+
+
+def page_record(blocks) -> dict:
+    content = (
+        '<html><body><div class="gws-localreviews__general-reviews-block" data-next-page-token="tok">'
+        + "".join(blocks) + '</div></body></html>'
+    )
+    return {"content": content, "name": "cafe", "scrape_ds": "2023-04-08", "place_id": "p1", "data_id": "d1"}
+
+
+def reviews(blocks, mode: str) -> pd.DataFrame:
+    return rp.get_page_reviews(page_record(blocks), "en", mode=mode)[COLUMNS]
+
+
+def test_modes_agree_on_a_complete_page():
+    blocks = [review_block(i) for i in range(4)]
+    per_block = reviews(blocks, "per_block")
+    assert per_block.reviewer_name.tolist() == ["User 0", "User 1", "User 2", "User 3"]
+    pd.testing.assert_frame_equal(per_block, reviews(blocks, "global"))
+
+
+def test_modes_agree_on_a_review_without_time():
+    blocks = [review_block(0), review_block(1, time=False), review_block(2)]
+    per_block = reviews(blocks, "per_block")
+    assert per_block.reviewer_name.tolist() == ["User 0", "User 2"]
+    pd.testing.assert_frame_equal(per_block, reviews(blocks, "global"))
+
+
+def test_per_block_keeps_fields_together_without_a_name():
+    complete = reviews([review_block(i) for i in range(3)], "global")
+    per_block = reviews([review_block(0), review_block(1, name=False), review_block(2)], "per_block")
+    assert per_block.reviewer_name.tolist() == ["User 0", "", "User 2"]
+    pd.testing.assert_frame_equal(per_block.iloc[[0, 2]], complete.iloc[[0, 2]])
+    assert per_block.time.tolist() == complete.time.tolist()
+    assert per_block.stars.tolist() == complete.stars.tolist()
@@ -0,0 +1,62 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from descobridor.queueing import serp_quota as sq
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    the time the quota sees, moved by hand, starting mid period
+    """
+    now = [datetime(2023, 4, 20, 12, 0)]
+
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now[0]
+
+    monkeypatch.setattr(sq, "datetime", FrozenDatetime)
+    monkeypatch.setattr(sq, "time", SimpleNamespace(time=lambda: now[0].timestamp()))
+    return now
+
+
+def test_billing_period():
+    assert sq.billing_period(datetime(2023, 4, 20), 8) == (datetime(2023, 4, 8), datetime(2023, 5, 8))
+    assert sq.billing_period(datetime(2023, 4, 3), 8) == (datetime(2023, 3, 8), datetime(2023, 4, 8))
+    assert sq.billing_period(datetime(2023, 1, 3), 8) == (datetime(2022, 12, 8), datetime(2023, 1, 8))
+    assert sq.billing_period(datetime(2023, 12, 9), 8) == (datetime(2023, 12, 8), datetime(2024, 1, 8))
+
+
+def test_burst_then_the_monthly_pace(datastores, clock):
+    quota = sq.SerpQuota(quota=3000, reset_day=8, burst=2)
+    # april 8 to may 8: 30 days for 3000 searches
+    assert quota.seconds_per_search() == pytest.approx(864)
+    assert quota.acquire() == 0
+    assert quota.acquire() == 0
+    assert quota.acquire() == pytest.approx(864)
+    assert quota.state()["used"] == 2
+
+
+def test_never_more_than_the_quota(datastores, clock):
+    quota = sq.SerpQuota(quota=2, reset_day=8, burst=5)
+    assert quota.acquire() == 0
+    assert quota.acquire() == 0
+    assert quota.is_exhausted()
+    # out until may 8
+    assert quota.acquire() == pytest.approx((datetime(2023, 5, 8) - clock[0]).total_seconds())
+
+
+def test_exhausted_until_the_reset(datastores, clock):
+    quota = sq.SerpQuota(quota=3000, reset_day=8, burst=2)
+    quota.acquire()
+    quota.exhaust()
+    assert quota.is_exhausted()
+    assert quota.acquire() > 0
+    clock[0] = datetime(2023, 5, 8, 0, 1)
+    assert quota.state() == {
+        "used": 0, "remaining": 3000, "seconds_until_reset": pytest.approx(31 * 24 * 3600 - 60)
+    }
+    assert quota.acquire() == 0